@@ -11,6 +11,12 @@ from pylab import *
 import matplotlib.pyplot as plt
 import scipy.special as sp
 
+# the stl reader and the interpolation of windpyfoam, for terrainGrid
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'windpyfoam'))
+import translateSTL
+from aglsurfaces import unique_vertices
+from interpolation import LinearWeights
+
 
 # RIX calculation
 
@@ -19,100 +25,155 @@ import scipy.special as sp
 # fraction (in %) of steep terrain within specified length (say 3.5 km) from a point of interest
 # steep means terrain slope above steepValue (say 0.3 or 0.4)
 
-def RIX2D(shape,point,distance,dx,steepValue):
+def profileSlopes(shape,dx):
     # shape      = tuple of x and y of the shape (hill, hill bunch, vally etc.)
-    # point      = x coordinate of point of interest
-    # distance   = distance from point to be included in calculations (downwind from point)
     # dx         = discritization of shape
-    # steepValue = value of dy/dx considered steep
-    
+    # returns the interpolated x and abs(dy/dx) at every x - central
+    # differences inside, first order one sided differences at the ends
+
     # interpolating to dx
     minX = min(shape[:][0])
     maxX = max(shape[:][0])
-    xVec = linspace(minX,maxX,(maxX-minX)/dx+1)
+    xVec = linspace(minX,maxX,int((maxX-minX)/dx)+1)
     yVec = interp(xVec,shape[:][0],shape[:][1])
-    N = len(xVec)
-    slope = zeros(N)    
-    slopeCounter = 0
-    for i,x in enumerate(xVec):
-        if(point<x and (point+distance)>x): 
-            slopeCounter = slopeCounter + 1
-            if i==0: 	
-                # calculating slope according to first order upwind differences
-                slope[i] = abs((yVec[i+1]-yVec[i]) / (xVec[i+1]-xVec[i]))
-            elif i==N: 	
-                # calculating slope according to first order downwind differences
-                slope[i] = abs((yVec[i]-yVec[i-1]) / (xVec[i]-xVec[i-1]))    # /dx
-            else: 		
-                # calculating slope according to central differences
-                slope[i] = abs((yVec[i+1]-yVec[i-1]) / (xVec[i+1]-xVec[i-1]))# /2*dx
-    
-    RIX = float(sum(slope>steepValue))/(slopeCounter)
-            
-    return RIX
+    return xVec, abs(gradient(yVec)/gradient(xVec))
 
-def averageSlope2D(shape,point,distance,dx,steepValue):
+def slopeStatistics(shape,points,distance,dx,steepValue):
     # shape      = tuple of x and y of the shape (hill, hill bunch, vally etc.)
-    # point      = x coordinate of point of interest
+    # points     = x coordinates of the points of interest, any number of them
     # distance   = distance from point to be included in calculations (downwind from point)
     # dx         = discritization of shape
     # steepValue = value of dy/dx considered steep
-    # returns average slope instead of RIX
-    
-    # interpolating to dx
-    minX = min(shape[:][0])
-    maxX = max(shape[:][0])
-    xVec = linspace(minX,maxX,(maxX-minX)/dx+1)
-    yVec = interp(xVec,shape[:][0],shape[:][1])
-    N = len(xVec)
-    slope = zeros(N)    
-    slopeCounter = 0
-    for i,x in enumerate(xVec):
-        if(point<x and (point+distance)>x): 
-            slopeCounter = slopeCounter + 1
-            if i==0: 	
-                # calculating slope according to first order upwind differences
-                slope[i] = abs((yVec[i+1]-yVec[i]) / (xVec[i+1]-xVec[i]))
-            elif i==N: 	
-                # calculating slope according to first order downwind differences
-                slope[i] = abs((yVec[i]-yVec[i-1]) / (xVec[i]-xVec[i-1]))    # /dx
-            else: 		
-                # calculating slope according to central differences
-                slope[i] = abs((yVec[i+1]-yVec[i-1]) / (xVec[i+1]-xVec[i-1]))# /2*dx
-    
-    averageSlope = float(sum(slope))/(slopeCounter)
-            
-    return averageSlope
-    
-def RIX3D(shape,point,distance,dx,steepValue):
+    # returns (RIX, averageSlope), arrays with a value per point. the slopes
+    # strictly between point and point+distance are included
+
+    xVec, slope = profileSlopes(shape,dx)
+    points = atleast_1d(asarray(points,dtype=float))
+    # prefix sums, so every point costs two binary searches
+    steepSum = concatenate(([0],cumsum(slope>steepValue)))
+    slopeSum = concatenate(([0],cumsum(slope)))
+    first = searchsorted(xVec,points,'right')
+    last = searchsorted(xVec,points+distance,'left')
+    slopeCounter = (last-first).astype(float)
+    RIX = (steepSum[last]-steepSum[first])/slopeCounter
+    averageSlope = (slopeSum[last]-slopeSum[first])/slopeCounter
+    return RIX, averageSlope
+
+def RIX2D(shape,point,distance,dx,steepValue):
     # shape      = tuple of x and y of the shape (hill, hill bunch, vally etc.)
     # point      = x coordinate of point of interest
     # distance   = distance from point to be included in calculations (downwind from point)
     # dx         = discritization of shape
     # steepValue = value of dy/dx considered steep
-    
-    # interpolating to dx
-    minX = min(shape[:][0])
-    maxX = max(shape[:][0])
-    xVec = linspace(minX,maxX,(maxX-minX)/dx+1)
-    yVec = interp(xVec,shape[:][0],shape[:][1])
-    N = len(xVec)
-    slope = zeros(N)    
-    slopeCounter = 0
-    for i,x in enumerate(xVec):
-        if(point<x and (point+distance)>x): 
-            slopeCounter = slopeCounter + 1
-            if i==0: 	
-                # calculating slope according to first order upwind differences
-                slope[i] = abs((yVec[i+1]-yVec[i]) / (xVec[i+1]-xVec[i]))
-            elif i==N: 	
-                # calculating slope according to first order downwind differences
-                slope[i] = abs((yVec[i]-yVec[i-1]) / (xVec[i]-xVec[i-1]))    # /dx
-            else: 		
-                # calculating slope according to central differences
-                slope[i] = abs((yVec[i+1]-yVec[i-1]) / (xVec[i+1]-xVec[i-1]))# /2*dx
-    
-    RIX = float(sum(slope>steepValue))/(slopeCounter)
-            
-    return RIX
+    return slopeStatistics(shape,point,distance,dx,steepValue)[0][0]
+
+def averageSlope2D(shape,point,distance,dx,steepValue):
+    # same arguments as RIX2D, returns average slope instead of RIX
+    return slopeStatistics(shape,point,distance,dx,steepValue)[1][0]
+
+# 3D RIX
+# WAsP style - the slopes along lines radial from the point of interest,
+# every 360/lines degrees, dr apart up to radius. the terrain is a height
+# raster z[j,i] at x[i], y[j] (regular, ascending), or a terrain stl that
+# is rasterized first. dz/dx and dz/dy are computed once for the raster,
+# the slope along a line is then abs(dz/dx cos(theta) + dz/dy sin(theta))
+# of the bilinearly sampled gradient. samples outside the raster are left out
+
+def terrainGrid(filename,dx):
+    # filename   = terrain stl
+    # dx         = raster spacing
+    # returns x, y, z of the terrain heights, nan where the stl has none
+    triangles, name = translateSTL.read_stl(filename)
+    vertices, index = unique_vertices(triangles)
+    x = arange(vertices[:,0].min(),vertices[:,0].max()+dx/2.,dx)
+    y = arange(vertices[:,1].min(),vertices[:,1].max()+dx/2.,dx)
+    xmesh, ymesh = meshgrid(x,y)
+    z = LinearWeights(vertices[:,:2],xmesh,ymesh)(vertices[:,2])
+    return x, y, z
+
+def slopeRasters(x,y,z):
+    # returns dz/dx and dz/dy of the raster, stacked
+    dzdy, dzdx = gradient(z,y[1]-y[0],x[1]-x[0])
+    return array([dzdx,dzdy])
+
+def bilinear(x,y,rasters,px,py):
+    # rasters    = one raster or a stack of them, sampled together
+    # px, py     = sample coordinates, any (same) shape
+    # returns the rasters at px, py, nan outside
+    fx = (px-x[0])/(x[1]-x[0])
+    fy = (py-y[0])/(y[1]-y[0])
+    outside = ~((fx>=0) & (fx<=len(x)-1) & (fy>=0) & (fy<=len(y)-1))
+    i = clip(nan_to_num(floor(fx)),0,len(x)-2).astype(int)
+    j = clip(nan_to_num(floor(fy)),0,len(y)-2).astype(int)
+    tx = fx-i
+    ty = fy-j
+    values = ((rasters[...,j,i]*(1-tx) + rasters[...,j,i+1]*tx)*(1-ty) +
+              (rasters[...,j+1,i]*(1-tx) + rasters[...,j+1,i+1]*tx)*ty)
+    values[...,outside] = nan
+    return values
+
+def radialSlopes(x,y,rasters,points,radius,dr,lines):
+    # returns abs slopes, (points, lines, samples), nan outside the raster
+    theta = arange(lines)*2*pi/lines
+    r = arange(1,int(ceil(float(radius)/dr)))*dr
+    c = cos(theta)[:,newaxis]
+    s = sin(theta)[:,newaxis]
+    px = points[:,0,newaxis,newaxis] + c*r
+    py = points[:,1,newaxis,newaxis] + s*r
+    dzdx, dzdy = bilinear(x,y,rasters,px,py)
+    return abs(dzdx*c + dzdy*s)
+
+def lineSums(x,y,rasters,points,radius,dr,steepValue,lines):
+    # returns the steep samples, the sum of the slopes and the samples
+    # inside the raster, each (points, lines)
+    slope = radialSlopes(x,y,rasters,points,radius,dr,lines)
+    valid = ~isnan(slope)
+    slope[~valid] = 0
+    return (slope>steepValue).sum(axis=-1), slope.sum(axis=-1), valid.sum(axis=-1)
+
+_raster = None
+
+def _initRaster(x,y,rasters):
+    global _raster
+    _raster = x, y, rasters
+
+def _lineSums(args):
+    x, y, rasters = _raster
+    return lineSums(x,y,rasters,*args)
 
+def RIX3D(terrain,points,radius,dr,steepValue,lines=72,processes=0,perLine=False,chunk=200000):
+    # terrain    = (x, y, z) height raster, or the terrain stl, rasterized at dr
+    # points     = (x, y) of a point of interest, or an array of them
+    # radius     = length of the radial lines
+    # dr         = distance between samples along a line
+    # steepValue = value of the slope considered steep
+    # lines      = number of radial lines
+    # processes  = worker processes, the points are split between them
+    # perLine    = RIX and average slope of every line instead of all lines together
+    # chunk      = samples (points x lines x samples per line) done at once
+    # returns (RIX, averageSlope), arrays of the points (x lines if perLine)
+    if isinstance(terrain,str):
+        terrain = terrainGrid(terrain,dr)
+    x, y, z = terrain
+    x = asarray(x,dtype=float)
+    y = asarray(y,dtype=float)
+    rasters = slopeRasters(x,y,asarray(z,dtype=float))
+    points = atleast_2d(asarray(points,dtype=float))
+    perPoint = lines*max(int(ceil(float(radius)/dr))-1,1)
+    step = max(chunk//perPoint,1)
+    jobs = [(points[k:k+step],radius,dr,steepValue,lines) for k in range(0,len(points),step)]
+    if processes:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes,_initRaster,(x,y,rasters))
+        try:
+            results = pool.map(_lineSums,jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [lineSums(x,y,rasters,*job) for job in jobs]
+    steep, slopeSum, slopeCounter = [concatenate(r).astype(float) for r in zip(*results)]
+    if not perLine:
+        # all the lines together, each weighted by its samples inside the raster
+        steep, slopeSum, slopeCounter = steep.sum(axis=1), slopeSum.sum(axis=1), slopeCounter.sum(axis=1)
+    return steep/slopeCounter, slopeSum/slopeCounter
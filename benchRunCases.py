@@ -0,0 +1,53 @@
+#!/usr/bin/python
+"""
+times the launch of dummy cases through runCases' scheduler, once with the
+old fixed i * stagger sleep before every case and once through the
+LaunchGate.
+
+a dummy case does `--prepare` seconds of start-up work (standing in for
+writing customRegexp and decomposePar) and then "starts the solver", which
+returns immediately. the time reported is the wall-clock until the last
+case started.
+
+usage: benchRunCases.py [--cases 100] [--stagger 2] [--prepare 0.05] [--slots 2]
+"""
+
+import sys
+import time
+from argparse import ArgumentParser
+
+from runCases import CoreScheduler, LaunchGate
+
+def staggered_case(i, stagger, prepare, t0):
+    time.sleep(i * stagger)
+    time.sleep(prepare)
+    return time.time() - t0
+
+def gated_case(i, gate, prepare, t0):
+    with gate:
+        time.sleep(prepare)
+    return time.time() - t0
+
+def launch(n_cases, func, args):
+    scheduler = CoreScheduler(n_cases)
+    t0 = time.time()
+    for i in xrange(n_cases):
+        scheduler.submit(i, 1, func, (i,) + args + (t0,))
+    started = [result for i, ok, result in scheduler.as_completed() if ok]
+    assert(len(started) == n_cases)
+    return max(started), time.time() - t0
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--cases', type=int, default=100, help='number of dummy cases')
+    parser.add_argument('--stagger', type=float, default=2.0, help='old per case stagger [s]')
+    parser.add_argument('--prepare', type=float, default=0.05, help='dummy start-up I/O per case [s]')
+    parser.add_argument('--slots', type=int, default=2, help='LaunchGate slots')
+    args = parser.parse_args(sys.argv[1:])
+    last, total = launch(args.cases, staggered_case, (args.stagger, args.prepare))
+    print "stagger %5.2f s:  last launch %8.2f s, total %8.2f s" % (args.stagger, last, total)
+    last, total = launch(args.cases, gated_case, (LaunchGate(args.slots), args.prepare))
+    print "gate %d slots:    last launch %8.2f s, total %8.2f s" % (args.slots, last, total)
+
+if __name__ == '__main__':
+    main()
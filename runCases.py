@@ -2,9 +2,17 @@
 
 import os
 import sys
+import signal
+import errno
 from os import path
 from glob import glob
 import multiprocessing as mp
+import Queue
+import pickle
+import traceback
+import threading
+import json
+import re
 import argparse
 from PyFoam.Applications.PlotRunner import PlotRunner
 from PyFoam.Applications.Runner import Runner
@@ -88,98 +96,508 @@ AddToMyFigure4
 
 """
 
-def runCasesFiles(names, cases, runArg, n):
-    start = os.getcwd()
-    for case in cases:
-        os.chdir(case)
-        # change customeRegexp
-        customRegexpName = "customRegexp.base"
-        with open(os.path.join(case, 'customRegexp.base'), 'w+') as fd:
-            fd.write(custom_reg_exp_contents)
-        title = "Residuals for %s" %case
-        customRegexpFile = ParsedParameterFile(customRegexpName)
-        customRegexpFile["myFigure"]["theTitle"] = ('"'+title+'"')
-        customRegexpFile.writeFile()
-        # delete the header lines - ParsedParameterFile requires them, but the customRegexp dosen't seem to work when their around...
-        lines = open(customRegexpName).readlines()
-        open('customRegexp', 'w').writelines(lines[12:])
-        print n
-        #  if n>1 make sure case is decomposed into n processors
-        if n > 1:
-            print "decomposing %(case)s" % locals()
-            ClearCase(" --processors-remove %(case)s" % locals())
-            Decomposer('--silent %(case)s %(n)s' % locals())
-
-    #print "sfoam debug:", repr(sys.argv)
-    os.chdir(start)
-
-    p = mp.Pool(len(cases))
+def residual_patterns(contents=custom_reg_exp_contents):
+    """
+    [(name, compiled regexp)] of the residuals plotted by customRegexp
+    """
+    ret = []
+    for expr, name in re.findall(r'expr "([^"]*)";.*?titles\s*\(\s*(\w+)', contents, re.DOTALL):
+        ret.append((name, re.compile(expr.replace('%f%', r'[-+0-9.eE]+'))))
+    return ret
+
+class _Tail(object):
+    """
+    complete lines appended to a file since the last call
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        self._fd = None
+        self._partial = ''
+
+    def lines(self):
+        if self._fd is None:
+            if not os.path.exists(self._filename):
+                return []
+            self._fd = open(self._filename)
+        data = self._partial + self._fd.read()
+        lines = data.split('\n')
+        self._partial = lines.pop()
+        return lines
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+
+class ConvergenceMonitor(object):
+    """
+    follows the solver log of a case (and the met mast probes, if the case
+    writes them) while the solver runs. when every residual in customRegexp
+    is below `residual` and the probed wind speeds changed by less than
+    `probe_tolerance` (relative) over the last `window` iterations, it asks
+    the solver to stop by setting stopAt writeNow in controlDict. without a
+    `residual` it only watches.
+
+    when the solver is done a convergence record (iterations, final
+    residuals, wall time) is written to convergence.json in the case.
+
+    use as a context manager around the solver run, or feed() it the solver
+    output yourself and call poll(), converged() and stop_solver().
+
+    progress, if given, is called every poll interval with the case,
+    iteration, percent of endTime, residuals and elapsed seconds.
+    """
+    log_pattern = 'PyFoam*Runner.simpleFoam.logfile'
+    probe_pattern = os.path.join('metMasts', '*', 'U')
+    time_re = re.compile(r'^Time = ([-+0-9.eE]+)')
+    execution_time_re = re.compile(r'^ExecutionTime = ([-+0-9.eE]+) s')
+    vector_re = re.compile(r'\(([^()]*)\)')
+
+    def __init__(self, case, residual=None, probe_tolerance=1e-3, window=50, poll=2.0,
+                 progress=None):
+        self._case = case
+        self._residual = residual
+        self._probe_tolerance = probe_tolerance
+        self._window = window
+        self._interval = poll
+        self._patterns = residual_patterns()
+        self._log = None
+        self._probes = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self.iteration = None
+        self.execution_time = None
+        self.residuals = {}
+        self.probe_speeds = []
+        self.stopped_early = False
+        self._old_stop_at = None
+        self._progress = progress
+        self._end_time = None
+        self._start = time.time()
+        self._last_progress = None
+
+    def __enter__(self):
+        self._start = time.time()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.poll()
+        self.restore()
+        self.write_record(time.time() - self._start)
+        return False
+
+    def _find(self, pattern):
+        found = sorted(glob(os.path.join(self._case, pattern)), key=os.path.getmtime)
+        if len(found) == 0:
+            return None
+        return _Tail(found[-1])
+
+    def feed(self, line):
+        m = self.time_re.match(line)
+        if m:
+            self.iteration = float(m.group(1))
+            return
+        m = self.execution_time_re.match(line)
+        if m:
+            self.execution_time = float(m.group(1))
+            return
+        for name, pattern in self._patterns:
+            m = pattern.match(line)
+            if m:
+                self.residuals[name] = float(m.group(1))
+                return
+
+    def feed_probe(self, line):
+        if line.startswith('#'):
+            return
+        speeds = []
+        for vector in self.vector_re.findall(line):
+            u = [float(x) for x in vector.split()]
+            speeds.append(sum(x * x for x in u) ** 0.5)
+        if len(speeds) > 0:
+            self.probe_speeds.append(speeds)
+            del self.probe_speeds[:-self._window]
+
+    def probes_plateaued(self):
+        if len(self.probe_speeds) == 0:
+            # no probes in this case, go by the residuals only
+            return True
+        if len(self.probe_speeds) < self._window:
+            return False
+        for history in zip(*self.probe_speeds):
+            scale = max(abs(sum(history) / len(history)), 1e-12)
+            if (max(history) - min(history)) / scale > self._probe_tolerance:
+                return False
+        return True
+
+    def converged(self):
+        if self._residual is None or len(self.residuals) == 0:
+            return False
+        if max(self.residuals.values()) > self._residual:
+            return False
+        return self.probes_plateaued()
+
+    def poll(self):
+        """
+        reads what was added to the solver log and the probes since the
+        last call
+        """
+        if self._log is None:
+            self._log = self._find(self.log_pattern)
+        if self._probes is None:
+            self._probes = self._find(self.probe_pattern)
+        if self._log is not None:
+            for line in self._log.lines():
+                self.feed(line)
+        if self._probes is not None:
+            for line in self._probes.lines():
+                self.feed_probe(line)
+        if self._progress is not None:
+            self.report_progress()
+
+    def report_progress(self):
+        now = time.time()
+        if self._last_progress is not None and now - self._last_progress < self._interval:
+            return
+        self._last_progress = now
+        if self._end_time is None:
+            try:
+                controlDict = ParsedParameterFile(os.path.join(self._case, 'system', 'controlDict'))
+                self._end_time = float(controlDict['endTime'])
+            except Exception:
+                self._end_time = 0
+        percent = None
+        if self.iteration is not None and self._end_time > 0:
+            percent = min(100.0, 100.0 * self.iteration / self._end_time)
+        self._progress(stage='solve', case=os.path.basename(self._case.rstrip('/')),
+                       iteration=self.iteration, percent=percent,
+                       residuals=self.residuals, elapsed=now - self._start)
+
+    def _set_stop_at(self, value):
+        controlDict = ParsedParameterFile(os.path.join(self._case, 'system', 'controlDict'))
+        old = controlDict['stopAt']
+        controlDict['stopAt'] = value
+        controlDict.writeFile()
+        return old
+
+    def stop_solver(self):
+        print "%s converged at iteration %s, stopping" % (self._case, self.iteration)
+        self._old_stop_at = self._set_stop_at('writeNow')
+        self.stopped_early = True
+
+    def restore(self):
+        """
+        puts back the stopAt stop_solver replaced
+        """
+        if self._old_stop_at is not None:
+            self._set_stop_at(self._old_stop_at)
+            self._old_stop_at = None
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.poll()
+            if not self.stopped_early and self.converged():
+                self.stop_solver()
+
+    def write_record(self, wall_time):
+        record = dict(iterations=self.iteration,
+                      final_residuals=self.residuals,
+                      execution_time=self.execution_time,
+                      wall_time=wall_time,
+                      converged=self.converged(),
+                      stopped_early=self.stopped_early,
+                      probe_speeds=self.probe_speeds[-1] if self.probe_speeds else None)
+        with open(os.path.join(self._case, 'convergence.json'), 'w') as fd:
+            json.dump(record, fd, indent=1, sort_keys=True)
+
+def _queue_proc(done, key, func, args):
+    # a group of its own, terminate() stops the job with its mpirun and
+    # solver children. SIGTERM is not the parent's
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        result = func(*args)
+    except (Exception, SystemExit), e:
+        traceback.print_exc()
+        done.put((key, False, repr(e)))
+        return
+    try:
+        pickle.dumps(result)
+    except Exception:
+        result = repr(result)
+    done.put((key, True, result))
+
+class CoreScheduler(object):
+    """
+    QueueProc: run jobs in their own process without ever using more than
+    `cores` processors at once.
+
+    every job states how many processors it needs (its procnr). pending jobs
+    are started in submission order as soon as enough cores are free, and a
+    job that does not fit lets the smaller jobs behind it use the leftover
+    cores. jobs with a higher priority are started first, and jobs may be
+    submitted while iterating over as_completed().
+
+    limits maps a group name to the number of its jobs allowed to run at
+    once. jobs of such a group (I/O bound post processing) are bounded by
+    that instead of taking processors from the core budget. the wall time
+    of every finished job is kept in elapsed[key].
+    """
+    def __init__(self, cores=None, limits=None):
+        if cores is None:
+            cores = mp.cpu_count()
+        assert(cores > 0)
+        self._cores = cores
+        self._free = cores
+        self._limits = dict(limits or {})
+        self._pending = []
+        self._running = {}
+        self._started = {}
+        self.elapsed = {}
+        self._done = mp.Queue()
+
+    def submit(self, key, procs, func, args=(), priority=0, group=None):
+        if group in self._limits:
+            procs = 0
+        elif procs > self._cores:
+            print "warning: %s asks for %d processors but only %d are available, running it alone" % (
+                key, procs, self._cores)
+            procs = self._cores
+        else:
+            procs = max(procs, 1)
+        self._pending.append((key, procs, func, args, priority, group))
+        # stable, so equal priorities keep their submission order
+        self._pending.sort(key=lambda job: -job[4])
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def running_count(self):
+        return len(self._running)
+
+    def start_pending(self):
+        """
+        starts the pending jobs that fit. as_completed does it after every
+        step, a caller with a long loop body calls it once it submitted the
+        follow up jobs, so the freed cores do not wait for the loop body
+        """
+        for job in list(self._pending):
+            key, procs, func, args, priority, group = job
+            if procs > self._free:
+                continue
+            if group in self._limits and self._group_running(group) >= self._limits[group]:
+                continue
+            self._pending.remove(job)
+            p = mp.Process(target=_queue_proc, args=(self._done, key, func, args))
+            p.start()
+            self._running[key] = (p, procs, group)
+            self._started[key] = time.time()
+            self._free -= procs
+
+    def _group_running(self, group):
+        return len([key for key, (p, procs, g) in self._running.items() if g == group])
+
+    def _next_done(self):
+        while True:
+            try:
+                return self._done.get(timeout=1)
+            except Queue.Empty:
+                # a process killed from outside never reports back
+                for key, (p, procs, group) in self._running.items():
+                    if not p.is_alive() and p.exitcode != 0:
+                        return (key, False, 'exit code %s' % p.exitcode)
+
+    def as_completed(self):
+        """
+        yields (key, ok, result) for every job as it finishes
+        """
+        self.start_pending()
+        while len(self._running) > 0:
+            key, ok, result = self._next_done()
+            p, procs, group = self._running.pop(key)
+            p.join()
+            self._free += procs
+            self.elapsed[key] = time.time() - self._started.pop(key)
+            # the caller sees the result before anything new is started
+            yield key, ok, result
+            self.start_pending()
+
+    def terminate(self):
+        """
+        drops the pending jobs and kills the running ones, each with its
+        process group
+        """
+        del self._pending[:]
+        for p, procs, group in self._running.values():
+            try:
+                os.killpg(p.pid, signal.SIGTERM)
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+                # the job did not make its group yet
+                p.terminate()
+            p.join()
+        self._running.clear()
+        self._free = self._cores
+
+class LaunchGate(object):
+    """
+    readiness gate around the start-up of a case: writing customRegexp and
+    decomposing the case are heavy on the file system, so at most `slots`
+    cases do them at the same time. a case only waits when the slots are
+    actually taken, the rest start right away.
+    """
+    def __init__(self, slots=2):
+        assert(slots > 0)
+        self._sem = mp.Semaphore(slots)
+
+    def __enter__(self):
+        self._sem.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._sem.release()
+        return False
+
+def prepare_case(case, n):
+    # change customeRegexp
+    customRegexpName = os.path.join(case, "customRegexp.base")
+    with open(customRegexpName, 'w+') as fd:
+        fd.write(custom_reg_exp_contents)
+    title = "Residuals for %s" %case
+    customRegexpFile = ParsedParameterFile(customRegexpName)
+    customRegexpFile["myFigure"]["theTitle"] = ('"'+title+'"')
+    customRegexpFile.writeFile()
+    # delete the header lines - ParsedParameterFile requires them, but the customRegexp dosen't seem to work when their around...
+    lines = open(customRegexpName).readlines()
+    open(os.path.join(case, 'customRegexp'), 'w').writelines(lines[12:])
+    #  if n>1 make sure case is decomposed into n processors
+    if n > 1:
+        print "decomposing %(case)s" % locals()
+        ClearCase(" --processors-remove %(case)s" % locals())
+        Decomposer('--silent %(case)s %(n)s' % locals())
+
+def start_case(d):
+    with d['gate']:
+        prepare_case(d['target'], d['tasks'])
+
+def runCasesFiles(names, cases, runArg, n, cores=None, launch_slots=2, convergence=None):
+    """
+    n is the procnr of every case, either one number for all or a list with
+    one entry per case. cores is the processor budget shared by all the cases,
+    defaults to the number of cpus. launch_slots is the number of cases
+    allowed to do their start-up I/O at the same time. convergence holds the
+    ConvergenceMonitor arguments used for every case.
+    """
+    if isinstance(n, (list, tuple)):
+        procnrs = list(n)
+    else:
+        procnrs = [n] * len(cases)
+    assert(len(procnrs) == len(cases))
+
+    scheduler = CoreScheduler(cores)
+    gate = LaunchGate(launch_slots)
     def start_loop():
         print "runArg=%s" % runArg
-        functions = {'plotRunner': run,
-                     'Runner': runNoPlot,
-                     'sfoam':runsfoam,}
-        func = functions[runArg]
-        pool_run_cases(p, names, cases, n, func)
+        func = run_functions[runArg]
+        queue_run_cases(scheduler, gate, names, cases, procnrs, func, convergence)
     try:
         start_loop()
     except KeyboardInterrupt:
-        try:
-            p.close()
-            p.join()
-        except KeyboardInterrupt:
-            p.terminate()
+        scheduler.terminate()
 
 def runCases(args):
     case_dir = args.case_dir
     runArg = args.runArg
     n = args.n
     cases = [x for x in glob('%s*' % os.path.join(os.getcwd(), case_dir)) if os.path.isdir(x)]
-    runCasesFiles(cases=cases, runArg=runArg, n=n)
+    names = [os.path.basename(x) for x in cases]
+    convergence = dict(residual=args.residual, probe_tolerance=args.probe_tolerance,
+                       window=args.window)
+    runCasesFiles(names=names, cases=cases, runArg=runArg, n=n, cores=args.cores,
+                  launch_slots=args.launch_slots, convergence=convergence)
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--case-dir', help='directory of cases to use', default='.')
     parser.add_argument('--runArg', default="sfoam",help='choices are: plotRunner, Runner and sfoam')
-    parser.add_argument('--n',default=1,help="number of processors for each parallel run. default is 1")
+    parser.add_argument('--n',default=1,type=int,help="number of processors for each parallel run. default is 1")
+    parser.add_argument('--cores',default=None,type=int,help="number of processors shared by all runs. default is the number of cpus")
+    parser.add_argument('--launch-slots',default=2,type=int,help="number of runs doing their start-up I/O (decomposition) at the same time. default is 2")
+    parser.add_argument('--residual',default=None,type=float,help="stop a run once all its residuals are below this. default is to run to endTime")
+    parser.add_argument('--probe-tolerance',default=1e-3,type=float,help="relative change of the probed wind speeds allowed over the window when stopping early")
+    parser.add_argument('--window',default=50,type=int,help="number of iterations the probed wind speeds have to stay steady")
     args = parser.parse_args(sys.argv[1:])
     runCases(args)
 
-def pool_run_cases(p, names, cases, n, f):
+def case_args(i, name, case, n, gate, convergence=None):
     if n > 1:
         procnr_args = '--procnr %s' % n
     else:
         procnr_args = ''
-    args = list(enumerate([
-        dict(name=name, target=case,
-             args=("--progress %(procnr_args)s simpleFoam -case %(case)s" % locals()).split(),
-             tasks=n
-             )
-               for name, case in zip(names, cases)]))
-    for result in p.imap_unordered(f, args):
-        print "%s: got %s" % (f.func_name, result)
+    return (i, dict(name=name, target=case,
+                    args=("--progress %(procnr_args)s simpleFoam -case %(case)s" % locals()).split(),
+                    tasks=n, gate=gate, convergence=convergence or {}
+                    ))
+
+def solveCase(name, case, runArg, n, gate, convergence=None):
+    """
+    runs a single case in the calling process, for callers doing their own
+    scheduling. convergence holds the ConvergenceMonitor arguments.
+    """
+    return run_functions[runArg](case_args(0, name, case, n, gate, convergence))
+
+def run_ok(result):
+    """
+    whether the result of a run_functions entry is a run that ended well:
+    the OK of a PyFoam application's data, the exit status of sfoam
+    """
+    if hasattr(result, 'getData'):
+        return result.getData().get('OK', True)
+    if isinstance(result, int):
+        return result == 0
+    return True
+
+def queue_run_cases(scheduler, gate, names, cases, procnrs, f, convergence=None):
+    for i, (name, case, n) in enumerate(zip(names, cases, procnrs)):
+        scheduler.submit(name, n, f, (case_args(i, name, case, n, gate, convergence),))
+    for name, ok, result in scheduler.as_completed():
+        if ok:
+            print "%s: %s got %s" % (f.func_name, name, result)
+        else:
+            print "%s: %s failed: %s" % (f.func_name, name, result)
 
 def run((i, d)):
     target, args = d['target'], d['args']
-    time.sleep(i * 2)
+    start_case(d)
     print "got %s" % repr(args)
-    return PlotRunner(args=args)
+    with ConvergenceMonitor(target, **d['convergence']):
+        return PlotRunner(args=args)
 
 def runNoPlot((i, d)):
     target, args = d['target'], d['args']
-    time.sleep(i * 2)
+    start_case(d)
     print "got %s" % repr(args)
-    return Runner(args=args)
+    with ConvergenceMonitor(target, **d['convergence']):
+        return Runner(args=args)
 
 def runsfoam((i, d)):
     tasks, target, args, name = d['tasks'], d['target'], d['args'], d['name']
-    time.sleep(i * 2)
+    start_case(d)
     print "---------------------- %s" % args
     print "sfoam - chdir to %s" % os.getcwd()
     print "calling sfoam tasks=%s target=%s" % (tasks, repr(target))
-    return sfoam.sfoam(main="pyFoamRunner.py", tasks=tasks, target=target,
-                       progname="/home/hanan/bin/OpenFOAM/sfoam.py",
-                       solver='simpleFoam', name=name, verbose=False)
+    with ConvergenceMonitor(target, **d['convergence']):
+        return sfoam.sfoam(main="pyFoamRunner.py", tasks=tasks, target=target,
+                           progname="/home/hanan/bin/OpenFOAM/sfoam.py",
+                           solver='simpleFoam', name=name, verbose=False)
+
+run_functions = {'plotRunner': run,
+                 'Runner': runNoPlot,
+                 'sfoam': runsfoam,}
 
 if __name__ == '__main__':
     main()
@@ -124,9 +124,9 @@ def sfoam(main, tasks, target, progname, solver, name, verbose):
             print locals()
             os.system('bash')
         if tasks==1:
-            os.system("%(main)s %(silent)s %(solver)s " % locals())
+            return os.system("%(main)s %(silent)s %(solver)s " % locals())
         else:
-            os.system("%(main)s --procnr=%(tasks)s %(silent)s --machinefile=%(machine_file)s %(solver)s " % locals())
+            return os.system("%(main)s --procnr=%(tasks)s %(silent)s --machinefile=%(machine_file)s %(solver)s " % locals())
     else:
         print "calling salloc for OpenFOAM"
         if verbose:
@@ -135,7 +135,7 @@ def sfoam(main, tasks, target, progname, solver, name, verbose):
             verbose_arg = ''
         salloc_cmd = "salloc -J %(name)s --tasks %(tasks)s %(progname)s %(verbose_arg)s --main %(main)s --target %(target)s --solver %(solver)s" % locals()
         print "calling: %s" % repr(salloc_cmd)
-        os.system(salloc_cmd)
+        return os.system(salloc_cmd)
 
 def main():
     parser = ArgumentParser()
@@ -26,6 +26,37 @@ def testRIX():
     plt.legend(('RIX','RIXequivalent'))
     show()
 	
+def testRIX3D():
+    # an axisymmetric bump, every radial line from its top is the 2D profile
+    H = 60.
+    AR = 3
+    dx = H/10
+    X,Y = hill_Martinez2D(H,AR,201)
+    x = y = linspace(-AR*H,AR*H,401)
+    xmesh, ymesh = meshgrid(x,y)
+    z = interp(sqrt(xmesh**2+ymesh**2),X,Y)
+    RIX3D, averageSlope3D = RIX.RIX3D((x,y,z),(0,0),AR*H/2,dx,0.3)
+    RIX2D = RIX.RIX2D((X,Y),0,AR*H/2,dx,0.3)
+    averageSlope2D = RIX.averageSlope2D((X,Y),0,AR*H/2,dx,0.3)
+    # both take the 14 samples 6 m apart, 8 of them are steep
+    assert(abs(RIX3D[0]-RIX2D) < 0.01)
+    assert(abs(averageSlope3D[0]-averageSlope2D) < 0.02*averageSlope2D)
+    # the points split between processes, every line on its own
+    points = [(0,0),(30,-20),(-50,10)]
+    serial = RIX.RIX3D((x,y,z),points,AR*H/2,dx,0.3,perLine=True)
+    parallel = RIX.RIX3D((x,y,z),points,AR*H/2,dx,0.3,perLine=True,processes=2,chunk=2000)
+    assert(serial[0].shape == (3,72))
+    assert(allclose(serial[0],parallel[0]) and allclose(serial[1],parallel[1]))
+
+def testRIX3DFlat():
+    x = y = linspace(-100,100,51)
+    z = zeros((len(y),len(x)))
+    RIX3D, averageSlope3D = RIX.RIX3D((x,y,z),[(0,0),(90,0)],50,4,0.3)
+    assert(all(RIX3D == 0) and all(averageSlope3D == 0))
+    # no samples inside the terrain
+    RIX3D, averageSlope3D = RIX.RIX3D((x,y,z),(500,500),50,4,0.3)
+    assert(isnan(RIX3D[0]))
+
 def hill_Martinez2D(H,AR,N):
 		A = 3.1926	
 		a = H*AR 	# [m]
@@ -34,4 +65,5 @@ def hill_Martinez2D(H,AR,N):
 		return X,Y
 		
 if __name__ == '__main__':
-testRIX()				
+    testRIX3D()
+    testRIX3DFlat()
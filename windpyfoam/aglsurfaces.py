@@ -0,0 +1,144 @@
+"""
+the above ground level sampling surfaces, made once per run and shared by
+all the cases.
+
+every case has the same terrain.stl, whatever the wind direction, so the
+terrain_agl_<h>.stl of a height is the same file for all of them. it is
+made once in the cache directory (the runs directory), keyed by a hash of
+the terrain, the height and the offset mode, and hard linked (copied,
+across file systems) into each case's constant/triSurface.
+
+offset 'z' shifts the terrain up by h, 'normal' moves every vertex h along
+its (area weighted, upward) vertex normal.
+
+with a lattice (xi, yi), the contour map grid, the terrain is first
+resampled onto it: its heights are interpolated at the lattice points and
+each lattice cell becomes two triangles. the surface then only covers what
+the contour maps show, at their resolution, instead of every terrain facet.
+"""
+
+import os
+import shutil
+
+import numpy
+
+import translateSTL
+from atomicfile import replace_file
+from fingerprints import file_digest
+from interpolation import LinearWeights
+
+def unique_vertices(triangles):
+    """
+    (vertices, index), the distinct vertices of triangles and for every
+    corner the index of its vertex
+    """
+    corners = numpy.ascontiguousarray(triangles.reshape(-1, 3))
+    _, first, index = numpy.unique(corners.view(numpy.dtype((numpy.void, 3 * corners.dtype.itemsize))),
+                                   return_index=True, return_inverse=True)
+    return corners[first], index
+
+def vertex_normals(triangles):
+    """
+    unit normals of the vertices of triangles, (N, 3, 3), pointing up.
+    a vertex shared by several facets gets the sum of their area weighted
+    normals, so the offset surface stays closed
+    """
+    vertices, index = unique_vertices(triangles)
+    facet = numpy.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    per_corner = numpy.repeat(facet, 3, axis=0)
+    # the terrain may be stored facing down, the offset is always upwards
+    per_corner[per_corner[:, 2] < 0] *= -1
+    summed = numpy.column_stack([numpy.bincount(index, weights=per_corner[:, k],
+                                                minlength=len(vertices))
+                                 for k in range(3)])
+    length = numpy.sqrt((summed ** 2).sum(axis=1))
+    length[length == 0] = 1
+    return (summed / length[:, numpy.newaxis])[index].reshape(triangles.shape)
+
+def lattice_surface(triangles, xi, yi):
+    """
+    the terrain resampled on the xi x yi lattice, two triangles a cell,
+    counter clockwise seen from above. cells with a corner outside the
+    terrain are left out
+    """
+    dx, dy = xi[1] - xi[0], yi[1] - yi[0]
+    # only the facets around the window take part in the interpolation
+    lo, hi = triangles.min(axis=1), triangles.max(axis=1)
+    near = ((hi[:, 0] >= xi[0] - dx) & (lo[:, 0] <= xi[-1] + dx) &
+            (hi[:, 1] >= yi[0] - dy) & (lo[:, 1] <= yi[-1] + dy))
+    vertices, _ = unique_vertices(triangles[near])
+    xmesh, ymesh = numpy.meshgrid(xi, yi)
+    z = LinearWeights(vertices[:, :2], xmesh, ymesh)(vertices[:, 2])
+    points = numpy.dstack((xmesh, ymesh, z))
+    a, b = points[:-1, :-1], points[:-1, 1:]
+    c, d = points[1:, 1:], points[1:, :-1]
+    cells = numpy.empty((2,) + a.shape[:2] + (3, 3))
+    for k, corner in enumerate([a, b, c]):
+        cells[0, :, :, k] = corner
+    for k, corner in enumerate([a, c, d]):
+        cells[1, :, :, k] = corner
+    cells = cells.reshape(-1, 3, 3)
+    return cells[~numpy.isnan(cells.reshape(-1, 9)).any(axis=1)]
+
+def offset_surface(triangles, h, offset='z'):
+    if offset == 'normal':
+        return triangles + h * vertex_normals(triangles)
+    if offset != 'z':
+        raise ValueError('unknown agl offset %r, z or normal' % offset)
+    return translateSTL.shift(triangles, dz=h)
+
+def offset_solids(solids, h, offset='z'):
+    """
+    offset_surface of the (name, triangles) solids of an stl, keeping them
+    apart. the vertex normals are those of all the solids together, so a
+    vertex on the border of two moves the same in both
+    """
+    if offset == 'z':
+        return translateSTL.shift_solids(solids, h)
+    names = [name for name, triangles in solids]
+    moved = offset_surface(numpy.concatenate([triangles for name, triangles in solids]), h, offset)
+    ends = numpy.cumsum([len(triangles) for name, triangles in solids])[:-1]
+    return zip(names, numpy.split(moved, ends))
+
+class SurfaceCache(object):
+
+    def __init__(self, cache_dir, offset='z', lattice=None):
+        self._dir = os.path.realpath(cache_dir)
+        self._offset = offset
+        self._lattice = lattice
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+
+    def surface(self, terrain, h):
+        """
+        the cached agl surface of terrain at height h, made if missing.
+        several cases may make the same surface at once, the last rename
+        wins and they are all the same
+        """
+        key = '%s_%s_%s' % (file_digest(terrain), self._offset, h)
+        if self._lattice is not None:
+            xi, yi = self._lattice
+            key += '_%dx%d_%g_%g_%g_%g' % (len(xi), len(yi), xi[0], xi[-1], yi[0], yi[-1])
+        filename = os.path.join(self._dir, 'terrain_agl_%s.stl' % key)
+        if os.path.exists(filename):
+            return filename
+        solids = translateSTL.read_solids(terrain)
+        if self._lattice is not None:
+            # one solid, the lattice covers all of the terrain
+            triangles = numpy.concatenate([t for name, t in solids])
+            solids = [(solids[0][0], lattice_surface(triangles, *self._lattice))]
+        replace_file(filename, lambda f: translateSTL.dump_solids(
+            f, offset_solids(solids, h, self._offset), binary=translateSTL.is_binary(terrain)))
+        return filename
+
+    def link(self, terrain, h, target):
+        """
+        puts the agl surface of terrain at height h in target
+        """
+        source = self.surface(terrain, h)
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
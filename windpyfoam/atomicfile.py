@@ -0,0 +1,38 @@
+"""
+replacing a file in one go.
+
+the new contents are written to a temporary file in the same directory and
+renamed over the old file once complete, so a reader sees the old file or
+the new one, never half of one. several writers may replace the same file
+at once, the last rename wins.
+"""
+
+import os
+import tempfile
+
+# mkstemp makes 0600 files, the new file gets the usual permissions instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def replace_file(filename, write, mode=None):
+    """
+    write(f) writes the contents to f, a file open for binary writing.
+    mode is the permission bits of the new file, by default those of the
+    file it replaces, or 0666 less the umask
+    """
+    directory = os.path.dirname(filename) or '.'
+    if mode is None:
+        if os.path.exists(filename):
+            mode = os.stat(filename).st_mode & 0777
+        else:
+            mode = 0666 & ~_UMASK
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(tmp, mode)
+        os.rename(tmp, filename)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
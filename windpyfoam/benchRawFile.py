@@ -0,0 +1,78 @@
+#!/usr/bin/python
+"""
+times reading sample raw surface files with genfromtxt, as plotContourMaps
+used to, against rawfile.read_raw without a cache, writing its cache and
+reading the memory mapped cache. the results are checked to be equal.
+
+without files a synthetic U_agl raw file of --points points is written to a
+temporary directory.
+
+usage: benchRawFile.py [--points 1000000] [--repeat 3] [surfaces/1000/U_agl_10.raw ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from argparse import ArgumentParser
+
+import numpy
+
+import rawfile
+
+def write_synthetic(filename, points):
+    data = numpy.random.random((points, 6)) * 1000
+    with open(filename, 'w') as fd:
+        fd.write('# x  y  z  U_x  U_y  U_z\n')
+        numpy.savetxt(fd, data, fmt='%g')
+
+def best_of(repeat, f):
+    times = []
+    for i in xrange(repeat):
+        t0 = time.time()
+        result = f()
+        times.append(time.time() - t0)
+    return min(times), result
+
+def bench(filename, repeat):
+    cached = rawfile.cache_filename(filename)
+    def cold():
+        if os.path.exists(cached):
+            os.remove(cached)
+        return rawfile.read_raw(filename, cache=True)
+    # the speeds force the mapped pages to be read
+    speed = lambda data: (data[:, 3] ** 2 + data[:, 4] ** 2) ** 0.5
+    t_gen, expected = best_of(repeat, lambda: numpy.genfromtxt(filename))
+    t_raw, data = best_of(repeat, lambda: rawfile.read_raw(filename))
+    assert(numpy.array_equal(expected, data))
+    t_cold, data = best_of(repeat, cold)
+    t_warm, s = best_of(repeat, lambda: speed(rawfile.read_raw(filename, cache=True)))
+    assert(numpy.array_equal(speed(expected), s))
+    print "%s: %d points" % (filename, len(expected))
+    print "  genfromtxt      %8.3f s" % t_gen
+    print "  read_raw        %8.3f s  (%5.1fx)" % (t_raw, t_gen / t_raw)
+    print "  + write cache   %8.3f s" % t_cold
+    print "  cached (mmap)   %8.3f s  (%5.1fx)" % (t_warm, t_gen / max(t_warm, 1e-6))
+    os.remove(cached)
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--points', type=int, default=1000000, help='points of the synthetic file')
+    parser.add_argument('--repeat', type=int, default=3, help='best of this many reads')
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args(sys.argv[1:])
+    if len(args.files) > 0:
+        for filename in args.files:
+            bench(filename, args.repeat)
+        return
+    d = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(d, 'U_agl_10.raw')
+        write_synthetic(filename, args.points)
+        bench(filename, args.repeat)
+    finally:
+        shutil.rmtree(d)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+input fingerprints of the stages a case goes through.
+
+every stage gets a hash of the windPyFoamDict entries it reads, chained with
+the fingerprint of the stage before it, so a change anywhere upstream also
+changes everything downstream. each case keeps the fingerprints of the
+stages it finished in windpyfoam.stages, and a resumed run only redoes the
+stages from the first one whose fingerprint changed.
+"""
+
+import os
+import json
+import hashlib
+
+from atomicfile import replace_file
+
+STAGES = ['mesh', 'bc', 'solve', 'reconstruct', 'sample']
+
+RECORD_NAME = 'windpyfoam.stages'
+
+def digest(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part))
+        h.update('\0')
+    return h.hexdigest()
+
+def update_file(h, filename):
+    """
+    feeds the contents of filename to the hash h, a chunk at a time
+    """
+    with open(filename, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), ''):
+            h.update(chunk)
+
+def file_digest(filename):
+    if not os.path.exists(filename):
+        return None
+    h = hashlib.sha1()
+    update_file(h, filename)
+    return h.hexdigest()
+
+def stage_fingerprints(wind_dict, params, template):
+    """
+    returns {stage: fingerprint} for the case described by params
+    (see Solver.wind_rose_params_generator). template is the template case
+    directory.
+    """
+    if 'i' in params:
+        # direction, speed and z0, the weight only goes into the averaging
+        rose = wind_dict["caseTypes"]["windRose"]["windDir"][params['i']][1:]
+        z0 = rose[1]
+    else:
+        rose = z0 = None
+    stl = file_digest(os.path.join(template, 'constant', 'triSurface', 'terrain.stl'))
+    fps = {}
+    # z0 sets the number of surface layers
+    fps['mesh'] = digest(os.path.realpath(template), stl, params['wind_dir'], params['cell_size'],
+                         wind_dict['SHMParams'], z0)
+    fps['bc'] = digest(fps['mesh'], rose, wind_dict['kEpsParams'], wind_dict['simParams'])
+    convergence = wind_dict['convergence'] if 'convergence' in wind_dict else None
+    fps['solve'] = digest(fps['bc'], convergence, wind_dict['runArg'], wind_dict['procnr'])
+    fps['reconstruct'] = digest(fps['solve'])
+    fps['sample'] = digest(fps['reconstruct'], wind_dict['Measurements'],
+                           wind_dict['sampleParams'])
+    return fps
+
+class CaseRecord(object):
+    """
+    fingerprints of the stages a case directory already went through
+    """
+    def __init__(self, case_dir):
+        self._filename = os.path.join(case_dir, RECORD_NAME)
+        self._done = {}
+        if os.path.exists(self._filename):
+            with open(self._filename) as fd:
+                self._done = json.load(fd)
+
+    def first_stale(self, fps):
+        """
+        first stage in STAGES whose fingerprint changed, None if the case is
+        up to date
+        """
+        for stage in STAGES:
+            if self._done.get(stage) != fps[stage]:
+                return stage
+        return None
+
+    def invalidate_from(self, stage):
+        for s in STAGES[STAGES.index(stage):]:
+            self._done.pop(s, None)
+        if os.path.exists(os.path.dirname(self._filename)):
+            self.save()
+
+    def mark(self, stage, fp):
+        self._done[stage] = fp
+        self.save()
+
+    def save(self):
+        replace_file(self._filename, lambda f: json.dump(self._done, f, indent=1, sort_keys=True))
@@ -0,0 +1,69 @@
+"""
+the interpolated contour grids as arrays, for viewers that render them
+instead of reading results.pdf.
+
+every grid is a float32 .npy file in the store directory, index.json lists
+them with their height, case, weight and the x/y extent. files are written
+to a temporary name and renamed, so a reader never sees half a grid. a
+level k view of a grid takes every 2**k-th point, level 0 is the full grid.
+"""
+
+import os
+import json
+import time
+from cStringIO import StringIO
+
+import numpy
+
+from atomicfile import replace_file
+
+INDEX = 'index.json'
+
+class GridStore(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._index = read_index(directory)
+
+    def put(self, name, grid, xi, yi, **meta):
+        """
+        stores grid (rows along yi, columns along xi) as name, meta goes to
+        the index as is
+        """
+        replace_file(os.path.join(self.directory, name + '.npy'),
+                     lambda f: numpy.save(f, numpy.asarray(grid, dtype=numpy.float32)))
+        meta.update(shape=list(grid.shape),
+                    x=[float(xi[0]), float(xi[-1])], y=[float(yi[0]), float(yi[-1])],
+                    updated=time.time())
+        self._index[name] = meta
+        replace_file(os.path.join(self.directory, INDEX),
+                     lambda f: json.dump(self._index, f, indent=1, sort_keys=True))
+
+def read_index(directory):
+    filename = os.path.join(directory, INDEX)
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+def grid_filename(directory, name):
+    """
+    None unless name is a grid of the index
+    """
+    if name not in read_index(directory):
+        return None
+    return os.path.join(directory, name + '.npy')
+
+def grid_bytes(filename, level=0):
+    """
+    the .npy bytes of the level view of a grid file
+    """
+    if level == 0:
+        with open(filename, 'rb') as f:
+            return f.read()
+    step = 2 ** level
+    out = StringIO()
+    numpy.save(out, numpy.ascontiguousarray(numpy.load(filename)[::step, ::step]))
+    return out.getvalue()
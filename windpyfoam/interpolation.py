@@ -0,0 +1,94 @@
+"""
+linear interpolation of scattered points onto a fixed grid, with the
+Delaunay triangulation and barycentric weights kept for reuse.
+
+scipy.interpolate.griddata triangulates the points on every call. here the
+weights of a point set are a sparse (grid points x data points) matrix, so
+interpolating another field on the same points (another height surface
+with the same x, y, another field, another case on the same mesh) is a
+single mat-vec. grid points outside the convex hull get nan, as with
+griddata.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy
+from scipy.spatial import Delaunay
+from scipy.sparse import csr_matrix
+
+class LinearWeights(object):
+
+    def __init__(self, points, xmesh, ymesh):
+        points = numpy.asarray(points, dtype=float)
+        self.shape = xmesh.shape
+        targets = numpy.column_stack((xmesh.ravel(), ymesh.ravel()))
+        tri = Delaunay(points)
+        simplex = tri.find_simplex(targets)
+        self.outside = simplex == -1
+        inside = numpy.nonzero(~self.outside)[0]
+        s = simplex[inside]
+        transform = tri.transform[s]
+        b = numpy.einsum('ijk,ik->ij', transform[:, :2, :], targets[inside] - transform[:, 2, :])
+        weights = numpy.column_stack((b, 1 - b.sum(axis=1)))
+        rows = numpy.repeat(inside, 3)
+        cols = tri.simplices[s].ravel()
+        self.matrix = csr_matrix((weights.ravel(), (rows, cols)),
+                                 shape=(len(targets), len(points)))
+
+    def __call__(self, values):
+        out = self.matrix.dot(numpy.asarray(values, dtype=float))
+        out[self.outside] = numpy.nan
+        return out.reshape(self.shape)
+
+class WeightsCache(object):
+    """
+    the weights of the last maxsize point sets onto one grid, keyed by a
+    hash of the point coordinates
+    """
+    def __init__(self, xmesh, ymesh, maxsize=16):
+        self._xmesh = xmesh
+        self._ymesh = ymesh
+        self._maxsize = maxsize
+        self._weights = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, points):
+        points = numpy.ascontiguousarray(points, dtype=float)
+        key = hashlib.sha1(points.view(numpy.uint8)).hexdigest()
+        if key in self._weights:
+            self.hits += 1
+            weights = self._weights.pop(key)
+        else:
+            self.misses += 1
+            weights = LinearWeights(points, self._xmesh, self._ymesh)
+            if len(self._weights) >= self._maxsize:
+                self._weights.popitem(last=False)
+        self._weights[key] = weights
+        return weights
+
+    def griddata(self, points, values):
+        """
+        same as scipy.interpolate.griddata(points, values, (xmesh, ymesh))
+        """
+        return self.get(points)(values)
+
+## Tests
+
+def test_matches_griddata():
+    from scipy.interpolate import griddata
+    points = numpy.random.random((2000, 2)) * 2 - 1
+    xi = numpy.linspace(-1.2, 1.2, 50)
+    xmesh, ymesh = numpy.meshgrid(xi, xi)
+    cache = WeightsCache(xmesh, ymesh)
+    for values in [numpy.hypot(points[:, 0], points[:, 1]), points[:, 0] * 3 - points[:, 1]]:
+        expected = griddata(points, values, (xmesh, ymesh))
+        got = cache.griddata(points, values)
+        assert(numpy.array_equal(numpy.isnan(expected), numpy.isnan(got)))
+        ok = ~numpy.isnan(expected)
+        assert(numpy.allclose(expected[ok], got[ok]))
+    assert(cache.misses == 1 and cache.hits == 1)
+
+if __name__ == '__main__':
+    test_matches_griddata()
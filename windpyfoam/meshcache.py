@@ -0,0 +1,118 @@
+"""
+content addressed cache of meshed cases.
+
+the key is a hash of everything the meshers read: the terrain stl, the
+rendered blockMeshDict and the rendered snappyHexMeshDict. a case with the
+same key gets the cached constant/polyMesh hard linked (or copied, across
+file systems) instead of running blockMesh and snappyHexMesh again, so
+changing z0, us or nu does not remesh anything.
+
+a stored mesh is copied into the cache, not linked, and the copy is made
+read only, so a utility writing into a linked mesh fails instead of
+silently changing the cache while the case that stored it keeps its own
+writable files. a copy of a linked mesh has to be made writable before a
+utility can change it.
+"""
+
+import os
+import stat
+import shutil
+import hashlib
+import tempfile
+
+from fingerprints import update_file
+
+MESH_INPUTS = ['constant/triSurface/terrain.stl',
+               'constant/polyMesh/blockMeshDict',
+               'system/snappyHexMeshDict']
+
+# per case files living in polyMesh that are inputs, not mesh
+NOT_CACHED = ['blockMeshDict', 'blockMeshDict.template']
+
+def mesh_key(case_dir, inputs=MESH_INPUTS):
+    h = hashlib.sha1()
+    for name in inputs:
+        h.update(name + '\0')
+        update_file(h, os.path.join(case_dir, name))
+    return h.hexdigest()
+
+def link_tree(src, dst, skip=(), copy=False):
+    """
+    hard links every file under src into dst, copying when linking fails
+    or copy is set
+    """
+    if not os.path.exists(dst):
+        os.makedirs(dst)
+    for name in os.listdir(src):
+        if name in skip:
+            continue
+        s, d = os.path.join(src, name), os.path.join(dst, name)
+        if os.path.isdir(s):
+            link_tree(s, d, copy=copy)
+            continue
+        if os.path.exists(d):
+            os.remove(d)
+        if copy:
+            shutil.copy2(s, d)
+            continue
+        try:
+            os.link(s, d)
+        except OSError:
+            shutil.copy2(s, d)
+
+def make_read_only(d):
+    for root, dirs, files in os.walk(d):
+        for name in files:
+            f = os.path.join(root, name)
+            os.chmod(f, os.stat(f).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+def make_writable(d):
+    for root, dirs, files in os.walk(d):
+        for name in files:
+            f = os.path.join(root, name)
+            os.chmod(f, os.stat(f).st_mode | stat.S_IWUSR)
+
+class MeshCache(object):
+
+    def __init__(self, cache_dir):
+        self._dir = os.path.realpath(cache_dir)
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+
+    def _entry(self, key):
+        return os.path.join(self._dir, key, 'polyMesh')
+
+    def __contains__(self, key):
+        return os.path.isdir(self._entry(key))
+
+    def fetch(self, key, case_dir):
+        """
+        returns True if the mesh was found and linked into case_dir
+        """
+        if key not in self:
+            return False
+        link_tree(self._entry(key), os.path.join(case_dir, 'constant', 'polyMesh'))
+        return True
+
+    def store(self, key, case_dir):
+        """
+        stores the mesh of case_dir, several cases may store the same key at
+        once, the first one to finish wins
+        """
+        if key in self:
+            return
+        tmp = tempfile.mkdtemp(prefix='.' + key, dir=self._dir)
+        try:
+            # a copy, chmodding linked files would make the case's own mesh
+            # read only too
+            link_tree(os.path.join(case_dir, 'constant', 'polyMesh'),
+                      os.path.join(tmp, 'polyMesh'), skip=NOT_CACHED, copy=True)
+            make_read_only(tmp)
+            try:
+                os.rename(tmp, os.path.join(self._dir, key))
+            except OSError:
+                # somebody else stored it first
+                pass
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
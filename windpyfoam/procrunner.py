@@ -0,0 +1,134 @@
+"""
+runs child processes (mpirun, OpenFOAM utilities) with Popen and follows
+their output from a single thread.
+
+any number of jobs may run at once: ProcessRunner select()s on all their
+pipes, splits the output into lines and hands every line to the job's
+on_line callback (and its output file, like tee). when a job ends its exit
+code is kept in job.returncode and on_exit is called.
+
+    runner = ProcessRunner()
+    runner.start(['mpirun', '-np', '4', 'snappyHexMesh', '-case', a], output_file='a.log')
+    runner.start(['mpirun', '-np', '4', 'snappyHexMesh', '-case', b], output_file='b.log')
+    for job in runner.wait():
+        print job.name, job.returncode
+"""
+
+import os
+import errno
+import select
+import subprocess
+
+class Job(object):
+
+    def __init__(self, argv, name=None, on_line=None, on_exit=None,
+                 output_file=None, cwd=None, env=None):
+        self.argv = argv
+        self.name = name or ' '.join(argv)
+        self.returncode = None
+        self._on_line = on_line
+        self._on_exit = on_exit
+        self._output = None
+        if output_file is not None:
+            self._output = open(output_file, 'w')
+        self._partial = ''
+        try:
+            self.process = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            close_fds=True, cwd=cwd, env=env)
+        except:
+            # a missing binary, the output file is not left open
+            if self._output is not None:
+                self._output.close()
+            raise
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def _line(self, line):
+        if self._output is not None:
+            self._output.write(line + '\n')
+        if self._on_line is not None:
+            self._on_line(self, line)
+
+    def _data(self, data):
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def _eof(self):
+        if self._partial != '':
+            self._line(self._partial)
+            self._partial = ''
+        self.process.stdout.close()
+        self.returncode = self.process.wait()
+        if self._output is not None:
+            self._output.close()
+        if self._on_exit is not None:
+            self._on_exit(self)
+
+    def kill(self):
+        if self.returncode is None:
+            self.process.kill()
+
+class ProcessRunner(object):
+
+    def __init__(self):
+        self._jobs = []
+
+    def start(self, argv, **kw):
+        """
+        starts argv right away, see Job for the keywords
+        """
+        job = Job(argv, **kw)
+        self._jobs.append(job)
+        return job
+
+    def running(self):
+        return list(self._jobs)
+
+    def poll(self, timeout=None):
+        """
+        handles the output available within timeout seconds (None blocks
+        until there is some). returns the jobs that ended
+        """
+        if len(self._jobs) == 0:
+            return []
+        try:
+            ready, _, _ = select.select(self._jobs, [], [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        ended = []
+        for job in ready:
+            data = os.read(job.fileno(), 1 << 16)
+            if data == '':
+                self._jobs.remove(job)
+                job._eof()
+                ended.append(job)
+            else:
+                job._data(data)
+        return ended
+
+    def wait(self):
+        """
+        runs until every job ended, yielding each job as it ends
+        """
+        while len(self._jobs) > 0:
+            for job in self.poll():
+                yield job
+
+    def run(self, argv, **kw):
+        """
+        runs argv alone and returns its exit code
+        """
+        job = self.start(argv, **kw)
+        for ended in self.wait():
+            pass
+        return job.returncode
+
+    def kill(self):
+        for job in self._jobs:
+            job.kill()
@@ -0,0 +1,56 @@
+"""
+fast reader for the raw surface files of sample (surfaces/<time>/*.raw).
+
+the '#' header lines are skipped and the rest of the file is parsed in one
+call by numpy.fromstring, then reshaped to the number of columns of the
+first data line. with cache, the array is also saved as <file>.npy next to
+the raw file and memory mapped on the next read, as long as the cache is
+newer than the raw file.
+"""
+
+import os
+
+import numpy
+
+from atomicfile import replace_file
+
+def parse_raw(text):
+    start = 0
+    while text.startswith('#', start):
+        start = text.find('\n', start) + 1
+        if start == 0:
+            return numpy.zeros((0, 0))
+    end = text.find('\n', start)
+    if end == -1:
+        end = len(text)
+    columns = len(text[start:end].split())
+    values = numpy.fromstring(text[start:], sep=' ')
+    if columns == 0 or len(values) % columns != 0:
+        raise ValueError('ragged raw file, %d values in %d columns' % (len(values), columns))
+    return values.reshape(-1, columns)
+
+def cache_filename(filename):
+    return filename + '.npy'
+
+def read_raw(filename, cache=False):
+    """
+    returns the data of filename as a float array, one row per point
+    """
+    cached = cache_filename(filename)
+    if cache and os.path.exists(cached) and \
+            os.path.getmtime(cached) >= os.path.getmtime(filename):
+        return numpy.load(cached, mmap_mode='r')
+    with open(filename) as fd:
+        data = parse_raw(fd.read())
+    if cache:
+        write_cache(cached, data)
+    return data
+
+def write_cache(cached, data):
+    """
+    a directory we can't write to just means no cache
+    """
+    try:
+        replace_file(cached, lambda f: numpy.save(f, data))
+    except (OSError, IOError):
+        pass
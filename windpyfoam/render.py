@@ -0,0 +1,111 @@
+"""
+headless figure rendering for results.pdf.
+
+Pages takes the place of PdfPages. contour pages are drawn with the object
+oriented Agg API, without the pyplot state machine, by a pool of worker
+processes, each page to its own one page pdf, and close() merges the pages
+into the pdf in the order they were added. figures drawn by the caller
+(savefig) keep their place in the same order. every figure is dropped as
+soon as it is saved.
+
+merging needs PyPDF2. without it, or with workers=0, the pages are drawn in
+this process straight into the pdf.
+"""
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy
+import matplotlib.cm as cm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+
+try:
+    from PyPDF2 import PdfFileMerger
+except ImportError:
+    PdfFileMerger = None
+
+def new_figure(**kw):
+    fig = Figure(**kw)
+    FigureCanvasAgg(fig)
+    return fig
+
+def contour_figure(title, xi, yi, grid):
+    fig = new_figure()
+    ax = fig.add_subplot(111)
+    ax.set_title(title)
+    CS = ax.contourf(xi, yi, grid, 400, cmap=cm.jet, linewidths=0)
+    fig.colorbar(CS, ax=ax)
+    return fig
+
+def render_contour(page, svg, title, xi, yi, grid):
+    fig = contour_figure(title, xi, yi, grid)
+    fig.savefig(page)
+    if svg is not None:
+        fig.savefig(svg)
+    fig.clf()
+    return page
+
+class Pages(object):
+
+    def __init__(self, filename, workers=2):
+        self.filename = filename
+        self._pool = None
+        if PdfFileMerger is None or workers == 0:
+            self._pdf = PdfPages(filename)
+            return
+        self._dir = tempfile.mkdtemp(prefix='.pages_',
+                                     dir=os.path.dirname(os.path.abspath(filename)))
+        self._pages = []
+        self._pool = multiprocessing.Pool(workers)
+
+    def _next_page(self):
+        return os.path.join(self._dir, 'page_%05d.pdf' % len(self._pages))
+
+    def contour(self, title, xi, yi, grid, svg=None):
+        """
+        a filled contour page of grid, also saved to svg if given
+        """
+        if self._pool is None:
+            fig = contour_figure(title, xi, yi, grid)
+            self._pdf.savefig(fig)
+            if svg is not None:
+                fig.savefig(svg)
+            fig.clf()
+            return
+        self._pages.append(self._pool.apply_async(render_contour,
+                (self._next_page(), svg, title, xi, yi, numpy.asarray(grid))))
+
+    def savefig(self, figure=None):
+        """
+        as PdfPages.savefig, the current pyplot figure by default
+        """
+        if figure is None:
+            from matplotlib import pyplot
+            figure = pyplot.gcf()
+        if self._pool is None:
+            self._pdf.savefig(figure)
+            return
+        page = self._next_page()
+        figure.savefig(page, format='pdf')
+        self._pages.append(page)
+
+    def close(self):
+        if self._pool is None:
+            self._pdf.close()
+            return
+        self._pool.close()
+        self._pool.join()
+        try:
+            merger = PdfFileMerger()
+            for page in self._pages:
+                if not isinstance(page, str):
+                    page = page.get()
+                merger.append(page)
+            with open(self.filename, 'wb') as fd:
+                merger.write(fd)
+        finally:
+            shutil.rmtree(self._dir)
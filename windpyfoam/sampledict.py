@@ -0,0 +1,90 @@
+"""
+writes the sets and surfaces of a case's system/sampleDict in one pass.
+
+the met masts (Measurements and sampleParams metMasts) become uniform
+vertical line sets and every hSample height a sampledTriSurfaceMesh
+surface of terrain_agl_<h>.stl. both blocks are rendered as text and put
+in place of the old ones, the rest of the file (fields, formats,
+interpolationScheme) is kept as the template has it. the file is written
+to a temporary name and renamed over the old one.
+"""
+
+import re
+
+from atomicfile import replace_file
+
+def mast_set(name, mast, n_points):
+    x, y, gl = mast['x'], mast['y'], mast['gl']
+    return ('    %s\n    {\n'
+            '        type        uniform;\n'
+            '        axis        z;\n'
+            '        start       (%s %s %s);\n'
+            '        end         (%s %s %s);\n'
+            '        nPoints     %s;\n'
+            '    }\n') % (name, x, y, gl, x, y, gl + mast['h'], n_points)
+
+def sets_block(wind_dict):
+    n_points = wind_dict['sampleParams']['nPoints']
+    masts = []
+    for d in [wind_dict['Measurements'], wind_dict['sampleParams']['metMasts']]:
+        masts.extend(mast_set(name, d[name], n_points) for name in d)
+    return 'sets\n(\n%s);\n' % '\n'.join(masts)
+
+def surface_name(h):
+    return 'agl_' + str(h)
+
+def surface_stl(h):
+    return 'terrain_agl_' + str(h) + '.stl'
+
+def surfaces_block(heights):
+    surfaces = ['    %s\n    {\n'
+                '        type        sampledTriSurfaceMesh;\n'
+                '        surface     %s;\n'
+                '        source      cells;\n'
+                '    }\n' % (surface_name(h), surface_stl(h)) for h in heights]
+    return 'surfaces\n(\n%s);\n' % '\n'.join(surfaces)
+
+def _skip_comment(text, i):
+    if text.startswith('//', i):
+        end = text.find('\n', i)
+        return len(text) if end == -1 else end
+    if text.startswith('/*', i):
+        end = text.find('*/', i + 2)
+        return len(text) if end == -1 else end + 2
+    return i
+
+def find_block(text, keyword):
+    """
+    (start, end) of 'keyword ( ... );' at the top level of text, None if
+    it is not there
+    """
+    for m in re.finditer(r'^[ \t]*%s\s*\(' % re.escape(keyword), text, re.M):
+        depth, i = 0, m.end() - 1
+        while i < len(text):
+            j = _skip_comment(text, i)
+            if j != i:
+                i = j
+                continue
+            if text[i] == '(':
+                depth += 1
+            elif text[i] == ')':
+                depth -= 1
+                if depth == 0:
+                    end = re.compile(r'\s*;?').match(text, i + 1).end()
+                    return m.start(), end
+            i += 1
+    return None
+
+def replace_block(text, keyword, block):
+    span = find_block(text, keyword)
+    if span is None:
+        return text.rstrip('\n') + '\n\n' + block
+    start, end = span
+    return text[:start] + block.rstrip('\n') + text[end:]
+
+def write_sample_dict(filename, wind_dict):
+    with open(filename) as fd:
+        text = fd.read()
+    text = replace_block(text, 'sets', sets_block(wind_dict))
+    text = replace_block(text, 'surfaces', surfaces_block(wind_dict['sampleParams']['hSample']))
+    replace_file(filename, lambda f: f.write(text))
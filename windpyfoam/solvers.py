@@ -1,28 +1,38 @@
 import sys
 import os
+import time
 import multiprocessing
 import itertools
 import glob
 import shutil
 import subprocess
-import translateSTL
+import tempfile
+import aglsurfaces
+import meshcache
+import fingerprints
+import gridstore
+import rawfile
+import sampledict
+from interpolation import WeightsCache
+from windaverage import WindRoseAverage
+from render import Pages, new_figure
+from procrunner import ProcessRunner
 from datetime import datetime
 from os import path, makedirs
 from math import pi, sin, cos, floor, log, sqrt
-import scipy.interpolate as sc
-from numpy import linspace, meshgrid, genfromtxt, zeros
+from numpy import linspace, meshgrid
 from matplotlib.backends.backend_pdf import PdfPages
 
 from PyFoam.RunDictionary.SolutionDirectory     import SolutionDirectory
 from PyFoam.RunDictionary.ParsedParameterFile   import ParsedParameterFile
 from PyFoam.Applications.ClearCase              import ClearCase
-from PyFoam.Applications.Runner                 import Runner
 from PyFoam.Basics.TemplateFile                 import TemplateFile
 from PyFoam.Applications.Decomposer             import Decomposer
 from PyFoam.Execution.BasicRunner 		        import BasicRunner
 
-sys.path.append('../')
-from runCases import runCasesFiles as runCases
+# runCases is next to the windpyfoam directory, whatever the cwd
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..'))
+from runCases import CoreScheduler, LaunchGate, solveCase, run_ok
 from windrose import WindroseAxes
 
 from matplotlib import pyplot as plt
@@ -46,6 +56,13 @@ def hist_to_time(distribution, values, n=1000):
         out_val.append(sum([[v]*p for p, v in zip(plurality, val)], []))
     return out_val
 
+def contour_grid(wind_dict):
+    """
+    x (and y) of the contour maps: Nx points over the refinement_length window
+    """
+    refinement_length = wind_dict['SHMParams']['domainSize']['refinement_length']
+    return linspace(-refinement_length,refinement_length,wind_dict['sampleParams']['Nx'])
+
 def read_dict_string(d, key):
     """
     to allow using a filename like so:
@@ -59,6 +76,65 @@ def read_dict_string(d, key):
         val = val[1:-1]
     return val
 
+def read_dict_default(d, key, default):
+    try:
+        return d[key]
+    except KeyError:
+        return default
+
+map_fields_dict_contents = \
+"""
+FoamFile
+{
+    version     2.0;
+    format      ascii;
+    class       dictionary;
+    location    system;
+    object      mapFieldsDict;
+}
+
+// the patches keep the boundary conditions of the target case
+patchMap ( );
+
+cuttingPatches ( );
+"""
+
+def angle_between(a, b):
+    """
+    smallest angle between two wind directions, in degrees
+    """
+    d = abs(a - b) % 360
+    return min(d, 360 - d)
+
+def warm_start_order(wind_dirs, weights):
+    """
+    order in which to run the wind rose directions when warm starting:
+    the heaviest direction first, then every time the direction furthest
+    from all the ones before it. the first cases, which run at the same
+    time and start cold, cover the rose, and every later one has a close
+    neighbour solved by the time it starts.
+    """
+    left = range(len(wind_dirs))
+    first = max(left, key=lambda i: weights[i])
+    order = [first]
+    left.remove(first)
+    while len(left) > 0:
+        far = max(left, key=lambda i: min(angle_between(wind_dirs[i], wind_dirs[j])
+                                          for j in order))
+        order.append(far)
+        left.remove(far)
+    return order
+
+def nearest_solved(wind_dir, us, solved):
+    """
+    solved holds (case_dir, wind_dir, cell_size, us) of the solved cases.
+    returns the one with the closest wind direction, then the closest us,
+    or None
+    """
+    if len(solved) == 0:
+        return None
+    return min(solved, key=lambda s: (angle_between(s[1], wind_dir), abs(s[3] - us)))
+
 class Solver(object):
     def __init__(self, reporter, plots):
         self._r = reporter
@@ -66,16 +142,19 @@ class Solver(object):
         self._fig_n = 1
 
     def initial_wind_rose_axes(self):
-        fig = self.newFigure(figsize=(8, 8), dpi=80, facecolor='w', edgecolor='w')
+        if self._plots == 'gui':
+            fig = self.newFigure(figsize=(8, 8), dpi=80, facecolor='w', edgecolor='w')
+        else:
+            fig = new_figure(figsize=(8, 8), dpi=80, facecolor='w', edgecolor='w')
         rect = [0.1, 0.1, 0.8, 0.8]
         ax = WindroseAxes(fig, rect, axisbg='w')
         fig.add_axes(ax)
         return ax
 
     def initial_wind_rose_legend(self, ax):
-        plt = self._r.plot
         l = ax.legend(axespad=-0.10)
-        plt.setp(l.get_texts(), fontsize=8)
+        for text in l.get_texts():
+            text.set_fontsize(8)
 
     def create_block_mesh_dict(self, work, wind_dict, params):
         phi = params['phi']
@@ -277,6 +356,26 @@ class Solver(object):
         4. decomposing the domain
         5. creating the snappyHexMesh - running in parallel (sfoam.py or not - depending on user input)
         6. decomposing the created mesh
+        2, 4 and 5 are skipped when the mesh cache already has this mesh
+        """
+        work, cached = self.create_case_dicts(wind_dict, params)
+        if not cached:
+            self._r.status('running block mesh')
+            self.run_block_mesh(work)
+            self._r.status('running decompose')
+            self.run_decompose(work, wind_dict)
+            self._r.status('running snappy hex mesh')
+            self.run_SHM(work, wind_dict)
+            # both raise when they fail, only a good mesh is stored
+            self.store_mesh(work, wind_dict)
+        self._r.status('running second decompose')
+        self.run_decompose(work, wind_dict)
+        return work
+
+    def create_case_dicts(self, wind_dict, params):
+        """
+        0, 1 and 3 of create_case, and fetching the mesh from the mesh cache.
+        returns the case and whether its mesh came from the cache
         """
         #--------------------------------------------------------------------------------------
         # cloning case
@@ -295,9 +394,6 @@ class Solver(object):
         #--
         # creating dictionaries
         #--
-        if wind_dict['procnr'] > multiprocessing.cpu_count():
-            self._r.warn('wind_dict contains a higher processor number then the machine has')
-            wind_dict['procnr'] = min(wind_dict['procnr'], multiprocessing.cpu_count())
         phi = params['wind_dir'] * pi / 180
         params['phi'] = phi # - pi/180 * 90
         self._r.status('creating block mesh dictionary')
@@ -306,15 +402,42 @@ class Solver(object):
         self.create_SHM_dict(work, wind_dict, params)
         self._r.status('creating boundary conditions dictionary')
         self.create_boundary_conditions_dict(work, wind_dict, params)
-        self._r.status('running block mesh')
-        self.run_block_mesh(work)
-        self._r.status('running decompose')
-        self.run_decompose(work, wind_dict)
-        self._r.status('running snappy hex mesh')
-        self.run_SHM(work, wind_dict)
-        self._r.status('running second decompose')
-        self.run_decompose(work, wind_dict)
-        return work
+        cache = self.mesh_cache(wind_dict)
+        if cache is not None:
+            key = meshcache.mesh_key(work.name)
+            if cache.fetch(key, work.name):
+                self._r.status('reusing cached mesh %s' % key)
+                return work, True
+        return work, False
+
+    def store_mesh(self, work, wind_dict):
+        cache = self.mesh_cache(wind_dict)
+        if cache is not None:
+            cache.store(meshcache.mesh_key(work.name), work.name)
+
+    def check_procnr(self, wind_dict):
+        if wind_dict['procnr'] > multiprocessing.cpu_count():
+            self._r.warn('wind_dict contains a higher processor number then the machine has')
+            wind_dict['procnr'] = min(wind_dict['procnr'], multiprocessing.cpu_count())
+
+    def core_budget(self, wind_dict):
+        """
+        number of processors shared by all the cases, cores in windPyFoamDict
+        """
+        return read_dict_default(wind_dict, 'cores', multiprocessing.cpu_count())
+
+    def mesh_cache(self, wind_dict):
+        """
+        meshCache in windPyFoamDict is the cache directory, no caching if
+        it is missing or empty
+        """
+        try:
+            cache_dir = read_dict_string(wind_dict, 'meshCache')
+        except KeyError:
+            return None
+        if cache_dir == '':
+            return None
+        return meshcache.MeshCache(cache_dir)
 
     def run_decompose(self, work, wind_dict):
         if wind_dict['procnr'] < 2:
@@ -329,23 +452,57 @@ class Solver(object):
         self._r.status("Running blockMesh")
         blockRun.start()
         if not blockRun.runOK():
+            # a failed mesh must not go into the mesh cache
             self._r.error("there was an error with blockMesh")
+            raise SystemExit
+
+    def print_line(self, job, line):
+        sys.stdout.write(line + '\n')
 
-    def mpirun(self, procnr, argv, output_file):
-        # TODO: use Popen and supply stdout for continous output monitor (web)
-        assert(type(procnr) is int)
-        args = ' '.join(argv)
-        os.system('mpirun -np %(procnr)s %(args)s | tee %(output_file)s' % locals())
+    def mpirun(self, procnr, argv, output_file, on_line=None):
+        """
+        runs argv under mpirun. the output goes to output_file and to
+        on_line(job, line), printed by default like tee.
+        returns the exit code
+        """
+        return self.mpirun_all([(procnr, argv, output_file)], on_line=on_line)[0]
+
+    def mpirun_all(self, jobs, on_line=None):
+        """
+        runs all of jobs, (procnr, argv, output_file) each, at the same time
+        and returns their exit codes
+        """
+        if on_line is None:
+            on_line = self.print_line
+        runner = ProcessRunner()
+        started = []
+        for procnr, argv, output_file in jobs:
+            assert(type(procnr) is int)
+            started.append(runner.start(['mpirun', '-np', str(procnr)] + list(argv),
+                                        output_file=output_file, on_line=on_line))
+        try:
+            for job in runner.wait():
+                if job.returncode != 0:
+                    self._r.warn('%s exited with %s' % (job.name, job.returncode))
+        except KeyboardInterrupt:
+            runner.kill()
+            raise
+        return [job.returncode for job in started]
+
+    def set_SHM_decomposition(self, work):
+        decomposeDict = ParsedParameterFile(
+        path.join(work.systemDir(), "decomposeParDict"))
+        decomposeDict["method"] = "ptscotch"
+        decomposeDict.writeFile()
 
     def run_SHM(self, work, wind_dict):
         if wind_dict["procnr"] > 1:
             self._r.status("Running SHM parallel")
-            decomposeDict = ParsedParameterFile(
-            path.join(work.systemDir(), "decomposeParDict"))
-            decomposeDict["method"] = "ptscotch"
-            decomposeDict.writeFile()
-            self.mpirun(procnr=wind_dict['procnrSnappy'], argv=['snappyHexMesh',
-                '-overwrite', '-case', work.name],output_file=path.join(work.name, 'SHM.log'))
+            self.set_SHM_decomposition(work)
+            if self.mpirun(procnr=wind_dict['procnrSnappy'], argv=['snappyHexMesh',
+                    '-overwrite', '-case', work.name],output_file=path.join(work.name, 'SHM.log')) != 0:
+                self._r.error("there was an error with snappyHexMesh, see %s" % path.join(work.name, 'SHM.log'))
+                raise SystemExit
             print 'running clearCase'
             ClearCase(args=work.name+'  --processors-remove')
         else:
@@ -354,6 +511,285 @@ class Solver(object):
                             server=False,logname="SHM")
             self._r.status("Running SHM uniprocessor")
             SHMrun.start()
+            if not SHMrun.runOK():
+                self._r.error("there was an error with snappyHexMesh")
+                raise SystemExit
+
+    def mesh_stage(self, wind_dict, params):
+        if os.path.exists(params['case_dir']):
+            # remeshing a resumed case, start from a fresh clone
+            shutil.rmtree(params['case_dir'])
+        return self.create_case(wind_dict, params).name
+
+    def bc_stage(self, wind_dict, params, case_dir):
+        work = SolutionDirectory(case_dir, archive=None, paraviewLink=False)
+        self.create_boundary_conditions_dict(work, wind_dict, params)
+
+    def solve_stage(self, wind_dict, params, name, case_dir, gate, clear, solved):
+        """
+        solved lists the cases to warm start from, as they were when this
+        stage started
+        """
+        if clear:
+            # drop the results of the previous run, startFrom is latestTime
+            ClearCase(args=case_dir)
+        windRose = wind_dict['caseTypes']['windRose']
+        if read_dict_default(windRose, 'warmStart', 0) and 'i' in params:
+            us = windRose['windDir'][params['i']][4]
+            source = nearest_solved(params['wind_dir'], us, solved.values())
+            if source is not None:
+                self.warm_start(wind_dict, params, case_dir, source)
+        self.create_probes_dict(case_dir, wind_dict)
+        runArg = read_dict_string(wind_dict, 'runArg')
+        result = solveCase(name=name, case=case_dir, runArg=runArg,
+                           n=wind_dict['procnr'], gate=gate,
+                           convergence=self.convergence_params(wind_dict))
+        if not run_ok(result):
+            # not recorded as solved, resume solves it again
+            raise RuntimeError('%s: the solver did not end well' % case_dir)
+
+    def create_probes_dict(self, case_dir, wind_dict):
+        """
+        probes U at the top of every met mast during the run, the
+        convergence monitor watches them
+        """
+        masts = wind_dict["Measurements"]
+        if len(masts) == 0:
+            return
+        locations = ['(%s %s %s)' % (masts[m]["x"], masts[m]["y"], masts[m]["gl"] + masts[m]["h"])
+                     for m in masts]
+        controlDict = ParsedParameterFile(path.join(case_dir, 'system', 'controlDict'))
+        probes = {'type': 'probes',
+                  'functionObjectLibs': '("libsampling.so")',
+                  'outputControl': 'timeStep',
+                  'outputInterval': 1,
+                  'fields': ['U'],
+                  'probeLocations': locations}
+        # the template's own function objects stay
+        if 'functions' not in controlDict:
+            controlDict['functions'] = {}
+        functions = controlDict['functions']
+        if isinstance(functions, list):
+            # the old functions ( name { ... } ) syntax
+            if 'metMasts' in functions:
+                functions[functions.index('metMasts') + 1] = probes
+            else:
+                functions.extend(['metMasts', probes])
+        else:
+            functions['metMasts'] = probes
+        controlDict.writeFile()
+
+    def convergence_params(self, wind_dict):
+        """
+        the optional convergence dictionary in windPyFoamDict:
+        residual (stop once all residuals are below it, default runs to
+        endTime), probeTolerance and window. the monitor reports the solver
+        progress to the reporter, if it takes progress
+        """
+        convergence = read_dict_default(wind_dict, 'convergence', {})
+        return dict(residual=read_dict_default(convergence, 'residual', None),
+                    probe_tolerance=read_dict_default(convergence, 'probeTolerance', 1e-3),
+                    window=read_dict_default(convergence, 'window', 50),
+                    progress=getattr(self._r, 'progress', None))
+
+    def warm_start(self, wind_dict, params, case_dir, source):
+        """
+        maps the converged fields of the source case onto case_dir as its
+        initial conditions. the source mesh and fields are first rotated
+        around the center of the domain by the difference in wind direction,
+        unless both cases share the mesh.
+        """
+        source_dir, source_dir_deg, source_cell_size, _us = source
+        self._r.status('warm starting %s from %s' % (case_dir, source_dir))
+        orig = SolutionDirectory(source_dir, archive=None, paraviewLink=False)
+        last = orig.getLast()
+        tmp = tempfile.mkdtemp(prefix='warm_start_', dir=os.path.dirname(case_dir))
+        try:
+            shutil.copytree(path.join(source_dir, 'system'), path.join(tmp, 'system'))
+            shutil.copytree(path.join(source_dir, 'constant'), path.join(tmp, 'constant'),
+                            ignore=shutil.ignore_patterns('triSurface'))
+            shutil.copytree(path.join(source_dir, last), path.join(tmp, last))
+            # a mesh fetched from the mesh cache is read only
+            meshcache.make_writable(tmp)
+            consistent = (source_dir_deg == params['wind_dir'] and
+                          source_cell_size == params['cell_size'])
+            if not consistent:
+                SHM = wind_dict["SHMParams"]
+                x0, y0 = SHM["centerOfDomain"]["x0"], SHM["centerOfDomain"]["y0"]
+                phi_s = source_dir_deg * pi / 180
+                phi_t = params['wind_dir'] * pi / 180
+                # the flow direction is (sin(phi), cos(phi), 0), see ABLConditions
+                for args in [['-translate', "'(%r %r 0)'" % (-x0, -y0)],
+                             ['-rotate', "'((%r %r 0) (%r %r 0))'" % (
+                                sin(phi_s), cos(phi_s), sin(phi_t), cos(phi_t)),
+                              '-rotateFields'],
+                             ['-translate', "'(%r %r 0)'" % (x0, y0)]]:
+                    if not self.run_utility(['transformPoints', '-case', tmp] + args,
+                                            'transformPoints'):
+                        return False
+                with open(path.join(case_dir, 'system', 'mapFieldsDict'), 'w') as fd:
+                    fd.write(map_fields_dict_contents)
+            argv = ['mapFields', tmp, '-case', case_dir, '-sourceTime', 'latestTime']
+            if consistent:
+                argv.append('-consistent')
+            return self.run_utility(argv, 'mapFields')
+        finally:
+            shutil.rmtree(tmp)
+
+    def run_utility(self, argv, logname):
+        run = BasicRunner(argv=argv, silent=True, server=False, logname=logname)
+        run.start()
+        if not run.runOK():
+            self._r.warn("there was an error with %s" % ' '.join(argv))
+            return False
+        return True
+
+    def reconstruct_stage(self, wind_dict, case_dir):
+        if len(glob.glob(path.join(case_dir, 'processor*'))) == 0:
+            # procnr 1, the case was solved whole
+            self._r.status('%s is not decomposed, skipped reconstruct' % case_dir)
+            return
+        failed = self.reconstructCases([case_dir], wind_dict)
+        if len(failed) > 0:
+            # the scheduler reports the stage as failed, it is not marked done
+            raise RuntimeError('%s failed' % ', '.join(failed))
+
+    def sample_stage(self, wind_dict, case_dir):
+        case = SolutionDirectory(case_dir, archive=None, paraviewLink=False)
+        failed = self.sampleDictionaries([case], case, wind_dict)
+        if len(failed) > 0:
+            raise RuntimeError('%s failed' % ', '.join(failed))
+
+    def run_pipeline(self, wind_dict, params_list, names, pdf, resume=False):
+        """
+        runs the cases of one windPyFoamDict, see run_sites.
+        returns the cases that went through all the stages
+        """
+        return self.run_sites([Site(self, wind_dict, params_list, names, pdf, resume=resume)])[0]
+
+    def run_sites(self, sites, cores=None):
+        """
+        every case goes through mesh -> solve -> reconstruct -> sample ->
+        contour on its own. the next stage of a case is queued as soon as the
+        previous one is done, so a slow snappyHexMesh only holds back its own
+        case. when cores free up the later stages go first, so cases that
+        are meshed flow through to results instead of waiting for the rest
+        of the meshing.
+        at most prepareWorkers cases of a site are meshed at the same time,
+        each taking procnrSnappy cores and solvers take procnr cores out of
+        the same core budget. the post processing stages (reconstruct,
+        sample) are I/O bound and run at most postWorkers at a time outside
+        of it. contour maps are plotted here as each case is sampled.
+
+        the cases of all the sites (see Site) share one core budget, cores,
+        by default the one of the first site's windPyFoamDict, and the
+        postWorkers of the first site.
+
+        the input fingerprints of every finished stage are kept in the case
+        directory. with resume, a case starts from the first stage whose
+        fingerprint changed (bc rewrites the boundary conditions of the
+        existing mesh) and up to date cases only get their contour maps.
+
+        with warmStart, a case is initialized from the nearest case of its
+        site already reconstructed when its solver starts (see warm_start).
+        returns the cases of every site that went through all the stages
+        """
+        stages = fingerprints.STAGES
+        first = sites[0].wind_dict
+        scheduler = CoreScheduler(cores or self.core_budget(first),
+                                  limits={'post': self.post_workers(first)})
+        gate = LaunchGate()
+        started = time.time()
+        total = len(stages) * sum(len(site.params_list) for site in sites)
+        stages_left = [total]
+        def progress(s, i, stage):
+            stages_left[0] -= 1
+            self.progress(stage=stage, case=sites[s].params_list[i]['name'],
+                          percent=100.0 * (1 - float(stages_left[0]) / total),
+                          elapsed=time.time() - started)
+        def submit(s, i, stage):
+            site = sites[s]
+            scheduler.submit((s, i, stage), site.stage_procs[stage],
+                             getattr(self, stage + '_stage'), site.stage_args(i, stage, gate),
+                             priority=stages.index(stage),
+                             group='post' if stage in ['reconstruct', 'sample'] else None)
+        for s, site in enumerate(sites):
+            for i in xrange(len(site.params_list)):
+                if site.resume:
+                    first_stale = site.records[i].first_stale(site.fps[i])
+                else:
+                    first_stale = 'mesh'
+                if first_stale in [None, 'sample']:
+                    site.add_solved(i)
+                for stage in stages[:stages.index(first_stale) if first_stale else len(stages)]:
+                    progress(s, i, stage)
+                if first_stale is None:
+                    self._r.status('%s is up to date' % site.params_list[i]['name'])
+                    site.up_to_date.append(i)
+                    continue
+                site.records[i].invalidate_from(first_stale)
+                if first_stale == 'mesh':
+                    site.unmeshed.append(i)
+                else:
+                    self._r.status('%s resuming from %s' % (site.params_list[i]['name'], first_stale))
+                    submit(s, i, first_stale)
+            for i in site.unmeshed[:site.workers]:
+                submit(s, i, 'mesh')
+            del site.unmeshed[:site.workers]
+        try:
+            for (s, i, stage), ok, result in scheduler.as_completed():
+                site = sites[s]
+                name = site.params_list[i]['name']
+                if stage == 'mesh' and len(site.unmeshed) > 0:
+                    submit(s, site.unmeshed.pop(0), 'mesh')
+                if not ok:
+                    self._r.error('%s failed at %s: %s' % (name, stage, result))
+                    continue
+                self._r.status('%s: %s done in %.1f s' % (name, stage, scheduler.elapsed[(s, i, stage)]))
+                site.records[i].mark(stage, site.fps[i][stage])
+                progress(s, i, stage)
+                if stage == 'mesh':
+                    # create_case wrote the boundary conditions as well
+                    site.records[i].mark('bc', site.fps[i]['bc'])
+                    stage = 'bc'
+                    progress(s, i, stage)
+                if stage == 'reconstruct':
+                    site.add_solved(i)
+                if stage != stages[-1]:
+                    submit(s, i, stages[stages.index(stage) + 1])
+                    continue
+                # the freed cores are busy while the maps are plotted
+                scheduler.start_pending()
+                self.plot_site_case(site, i)
+        finally:
+            # whatever goes wrong here, no mesher or solver is left running
+            scheduler.terminate()
+        for site in sites:
+            for i in site.up_to_date:
+                self.plot_site_case(site, i)
+            site.contours.plot_average(site.pdf)
+        return [site.done for site in sites]
+
+    def plot_site_case(self, site, i):
+        """
+        contour maps of a finished case of site. a case that can't be
+        plotted is reported and left out of the results
+        """
+        case = SolutionDirectory(site.case_dirs[i], archive=None, paraviewLink=False)
+        self._r.status('Ploting contour maps for ' + case.name)
+        try:
+            site.contours.plot_case(case, site.params_list[i], site.pdf)
+        except Exception, e:
+            self._r.error('%s: plotting contour maps failed: %s' % (case.name, e))
+            return
+        site.done.append(case)
+
+    def progress(self, **record):
+        """
+        passes a progress record on to reporters that take them
+        """
+        if hasattr(self._r, 'progress'):
+            self._r.progress(**record)
 
     def makedirs(self, d):
         self._r.debug('creating %r' % d)
@@ -365,7 +801,7 @@ class Solver(object):
         """
         grid_convergence = wind_dict["caseTypes"]["gridConvergenceParams"]
         gridRange = grid_convergence['gridRange']
-        template = read_dict_string(wind_dict, 'template')
+        template = os.path.basename(read_dict_string(wind_dict, 'template'))
         wind_dir = grid_convergence['windDir']
         for i, cell_size in enumerate(gridRange):
             case_dir = os.path.join(wind_dict['runs'],
@@ -376,12 +812,18 @@ class Solver(object):
     def wind_rose_params_generator(self, wind_dict):
         """
         yields names of case directories
-        one for each direction from wind rose
+        one for each direction from wind rose, in warm_start_order when
+        warmStart is set
         """
         windRose = wind_dict['caseTypes']["windRose"]
-        template = read_dict_string(wind_dict, 'template')
+        template = os.path.basename(read_dict_string(wind_dict, 'template'))
         cell_size = windRose['blockMeshCellSize']
-        for i, (_weight, wind_dir, _z0, _TKE_us2, _us) in enumerate(windRose['windDir']):
+        order = range(len(windRose['windDir']))
+        if read_dict_default(windRose, 'warmStart', 0):
+            order = warm_start_order([d[1] for d in windRose['windDir']],
+                                     [d[0] for d in windRose['windDir']])
+        for i in order:
+            (_weight, wind_dir, _z0, _TKE_us2, _us) = windRose['windDir'][i]
             case_dir = os.path.join(wind_dict['runs'],
                                 '%(template)s_rose_%(wind_dir)s' % locals())
             yield dict(case_dir = case_dir, i = i, wind_dir = wind_dir, cell_size = cell_size,
@@ -401,65 +843,92 @@ class Solver(object):
             d = pristine
         return d
 
-    def reconstructCases(self, cases):
-        for case in cases:
-            Runner(args=["reconstructPar" ,"-latestTime", "-case" ,case])
+    def post_workers(self, wind_dict):
+        """
+        reconstructPar and sample runs at the same time, postWorkers in
+        windPyFoamDict. they are I/O bound and not counted in the cores
+        """
+        return read_dict_default(wind_dict, 'postWorkers', 4)
+
+    def post_process(self, jobs, workers):
+        """
+        runs the (name, argv, output_file) jobs, at most workers at a time,
+        reporting how long each one took. returns the names of the failed
+        """
+        runner = ProcessRunner()
+        pending = list(jobs)
+        started = {}
+        failed = []
+        def start():
+            while len(pending) > 0 and len(runner.running()) < workers:
+                name, argv, output_file = pending.pop(0)
+                job = runner.start(argv, name=name, output_file=output_file)
+                started[job] = time.time()
+        try:
+            start()
+            while len(runner.running()) > 0:
+                for job in runner.poll():
+                    elapsed = time.time() - started.pop(job)
+                    if job.returncode != 0:
+                        self._r.warn('%s exited with %s after %.1f s' % (job.name, job.returncode, elapsed))
+                        failed.append(job.name)
+                    else:
+                        self._r.status('%s done in %.1f s' % (job.name, elapsed))
+                start()
+        except KeyboardInterrupt:
+            runner.kill()
+            raise
+        return failed
+
+    def reconstructCases(self, cases, wind_dict):
+        """
+        returns the names of the failed reconstructPar runs
+        """
+        return self.post_process([('reconstructPar ' + case,
+                                   ["reconstructPar" ,"-latestTime", "-case" ,case],
+                                   path.join(case, 'log.reconstructPar'))
+                                  for case in cases], self.post_workers(wind_dict))
 
     def sampleDictionaries(self, cases, work, wind_dict):
-        # TODO - at the moment for 90 degrees phi only and in line instead of in a function
+        """
+        returns the names of the failed sample runs
+        """
         for case in cases:
-            self._r.status('preparing Sample file for case '+case.name)
-            sampleFile = ParsedParameterFile(path.join(case.systemDir(), "sampleDict"))
-            del sampleFile.content['sets'][:]
-            if len(wind_dict["Measurements"]) > 0:
-                self._r.status("creating sample locations for measurements")
-                for metMast in wind_dict["Measurements"]:
-                    self._r.status("adding met mast " + metMast)
-                    # creating sub directory entry
-                    sampleFile.content['sets'].append(metMast)
-                    # creating another fictional sub directory entry - so that i can run it over in a second
-                    sampleFile.content['sets'].append([metMast])
-                    sampleFile['sets'][len(sampleFile['sets'])-1] = \
-                    {'type':'uniform', 'axis':'z',\
-                    'start':'('+str(wind_dict["Measurements"][metMast]["x"])+" "\
-                               +str(wind_dict["Measurements"][metMast]["y"])+" "\
-                               +str(wind_dict["Measurements"][metMast]["gl"])+")",\
-                    'end':  '('+str(wind_dict["Measurements"][metMast]["x"])+" "\
-                               +str(wind_dict["Measurements"][metMast]["y"])+" "\
-                               +str(wind_dict["Measurements"][metMast]["gl"]+\
-                                    wind_dict["Measurements"][metMast]["h"])+")",\
-                    'nPoints':wind_dict['sampleParams']['nPoints']}
-            if len(wind_dict['sampleParams']['metMasts'])>0:
-               self._r.status("creating sample locations for sampleParams")
-               for metMast in wind_dict['sampleParams']['metMasts']:
-                    # creating sub directory entry
-                    sampleFile.content['sets'].append(metMast)
-                    # creating another fictional sub directory entry - so that i can run it over in a second
-                    sampleFile.content['sets'].append([metMast])
-                    sampleFile['sets'][len(sampleFile['sets'])-1] = \
-                    {'type':'uniform', 'axis':'z',\
-                    'start':'('+str(wind_dict["sampleParams"]["metMasts"][metMast]["x"])+" "\
-                               +str(wind_dict["sampleParams"]["metMasts"][metMast]["y"])+" "\
-                               +str(wind_dict["sampleParams"]["metMasts"][metMast]["gl"])+")",\
-                    'end':  '('+str(wind_dict["sampleParams"]["metMasts"][metMast]["x"])+" "\
-                               +str(wind_dict["sampleParams"]["metMasts"][metMast]["y"])+" "\
-                               +str(wind_dict["sampleParams"]["metMasts"][metMast]["gl"]+\
-                                    wind_dict["sampleParams"]["metMasts"][metMast]["h"])+")",\
-                    'nPoints':wind_dict['sampleParams']['nPoints']}
-
-            del sampleFile.content['surfaces'][:]
-            for i,h in enumerate(wind_dict['sampleParams']['hSample']):
-                self._r.status('preparing sampling surface at '+str(h)+' meters agl')
-                translateSTL.stl_shift_z_filenames(path.join(case.name,'constant/triSurface/terrain.stl'), path.join(case.name,'constant/triSurface/terrain_agl_'+str(h)+'.stl'), h)
-                # creating sub directory entry
-                sampleFile.content['surfaces'].append('agl_'+str(h))
-                # creating another fictional sub directory entry - so that i can run it over in a second
-                sampleFile.content['surfaces'].append(['agl_'+str(h)])
-                sampleFile['surfaces'][len(sampleFile['surfaces'])-1]={'type':'sampledTriSurfaceMesh','surface':'terrain_agl_'+str(h)+'.stl','source':'cells'}
-            sampleFile.writeFile()
-            self._r.status('Sampling case '+case.name)
-            Runner(args=["sample" ,"-latestTime", "-case" ,case.name])
+            self.write_sample_dict(case, wind_dict)
+        self._r.status('Sampling %d cases' % len(cases))
+        return self.post_process([('sample ' + case.name,
+                                   ["sample" ,"-latestTime", "-case" ,case.name],
+                                   path.join(case.name, 'log.sample'))
+                                  for case in cases], self.post_workers(wind_dict))
 
+    def agl_surfaces(self, wind_dict):
+        """
+        the surface cache of the run. aglOffset in sampleParams is z
+        (default, the terrain shifted up) or normal (along the vertex normals).
+        with resampleSurfaces the surfaces are the terrain resampled on the
+        contour map grid
+        """
+        try:
+            offset = read_dict_string(wind_dict['sampleParams'], 'aglOffset')
+        except KeyError:
+            offset = 'z'
+        lattice = None
+        if read_dict_default(wind_dict['sampleParams'], 'resampleSurfaces', 0):
+            xi = contour_grid(wind_dict)
+            lattice = (xi, xi)
+        return aglsurfaces.SurfaceCache(path.join(wind_dict['runs'], 'agl_surfaces'), offset, lattice)
+
+    def write_sample_dict(self, case, wind_dict):
+        # TODO - at the moment for 90 degrees phi only
+        self._r.status('preparing Sample file for case '+case.name)
+        surfaces = self.agl_surfaces(wind_dict)
+        terrain = path.join(case.name, 'constant/triSurface/terrain.stl')
+        for h in wind_dict['sampleParams']['hSample']:
+            self._r.status('preparing sampling surface at '+str(h)+' meters agl')
+            surfaces.link(terrain, h, path.join(case.name, 'constant/triSurface', sampledict.surface_stl(h)))
+        self._r.status("creating sample locations for %d met masts" %
+                       (len(wind_dict["Measurements"]) + len(wind_dict['sampleParams']['metMasts'])))
+        sampledict.write_sample_dict(path.join(case.systemDir(), "sampleDict"), wind_dict)
 
     def writeMetMastLocations(self, case): # will replace the following 4 lines
         print 'TODO writeMetMastLocations'
@@ -467,6 +936,15 @@ class Solver(object):
     def calcHitRate(self, cases, pdf, wind_dict):
         print "TODO calcHitRate"
 
+    def plot_workers(self, wind_dict):
+        """
+        processes drawing the pages of results.pdf, plotWorkers in
+        windPyFoamDict. the gui draws with pyplot, in this process
+        """
+        if self._plots == 'gui':
+            return 0
+        return read_dict_default(wind_dict, 'plotWorkers', 2)
+
     def newFigure(self, *args, **kw):
         fig = plt.figure(self._fig_n, *args, **kw)
         self._fig_n += 1
@@ -480,35 +958,10 @@ class Solver(object):
         self._r.status('PLOT %s' % filename)
 
     def plotContourMaps(self, cases, pdf, wind_dict):
-        refinement_length = wind_dict['SHMParams']['domainSize']['refinement_length']
-        xi = linspace(-refinement_length,refinement_length,wind_dict['sampleParams']['Nx'])
-        yi = xi
-        xmesh, ymesh = meshgrid(xi, yi)
-        hs = wind_dict['sampleParams']['hSample']
-        avgV = zeros((len(hs), len(xi), len(yi)))
-        plt = self._r.plot
+        contours = ContourMaps(self, wind_dict)
         for i, case in enumerate(cases):
-            lastTime = genfromtxt(path.join(case.name,'PyFoamState.CurrentTime'))
-            for hi, h in enumerate(hs):
-                data = genfromtxt(path.join(case.name,'surfaces/'+str(int(lastTime))+'/U_agl_'+str(h)+'.raw'))
-                # after a long trial and error - matplotlib griddata is shaky and crashes on some grids. scipy.interpolate works on every grid i tested so far
-                vi = sc.griddata((data[:,0].ravel(),data[:,1].ravel()), (data[:,3].ravel()**2+data[:,4].ravel()**2)**0.5, (xmesh,ymesh))
-                ax = self.newFigure()
-                plt.title(case.name+'\n at height '+str(h)+' meter agl')
-                CS = plt.contourf(xi, yi, vi, 400,cmap=plt.cm.jet,linewidths=0)
-                plt.colorbar(CS)
-                pdf.savefig()
-                self.save_svg(os.path.join(case.name, 'contour'), ax.figure)
-                # assuming the windDir weights are normalized
-                #import pdb; pdb.set_trace()
-                avgV[hi, :, :] += vi * wind_dict["caseTypes"]["windRose"]["windDir"][i][0]
-        for hi, h in enumerate(hs):
-            ax = self.newFigure()
-            plt.title('average wind velocity at height ' + str(h) + ' meter agl')
-            CS = plt.contourf(xi, yi, avgV[hi, :, :], 400, cmap=plt.cm.jet, linewidths=0)
-            plt.colorbar(CS)
-            pdf.savefig()
-            self.save_svg('average_wind_velocity_h_%s' % str(h), ax.figure)
+            contours.plot_case(case, dict(i=i), pdf)
+        contours.plot_average(pdf)
 
     def plot_initial_wind_rose(self, wind_dict, params):
         #windrose like a stacked histogram with normed (displayed in percent) results
@@ -521,8 +974,9 @@ class Solver(object):
         self.initial_wind_rose_legend(ax)
         # TODO: add save_svg to windrose
         #self.save_svg('initial_wind_rose_axes', ax.figure)
+        return ax
 
-    def run_windpyfoam(self, dict):
+    def run_windpyfoam(self, dicts, resume=None, cores=None):
         """
         Mesh: creating the write snappyHexMeshDict file
         use the right snappyHexMeshDict_XXX.template file with wind_dict
@@ -538,7 +992,7 @@ class Solver(object):
             5. decomposing the created mesh
             6. running pyFoamRunner.py through sfoam (or not - depending on user input)
 
-        After all cases stop running
+        Each case continues on its own as soon as it is solved (see run_pipeline)
         7. if exist (usually) - reading real measurements
         8. creating sampleDict according to measurement locations and user input
             (which asks for wind speed contour map at certain height above ground)
@@ -551,6 +1005,43 @@ class Solver(object):
             error according to some known grid convergence algorithm
             3. a "hit rate" which shows the aggreement of the simulated wind speeds
             and turbulence to the measurements
+
+        resume is the runs directory of an earlier run, only the stages whose
+        inputs changed since are redone in it.
+
+        dicts is a windPyFoamDict or a list of them, sites, whose cases all
+        run at once sharing one core budget (see run_sites). everything a
+        site reads and writes is next to its windPyFoamDict.
+        """
+        if isinstance(dicts, basestring):
+            dicts = [dicts]
+        if resume is not None and len(dicts) > 1:
+            self._r.error("resume takes a single windPyFoamDict")
+            raise SystemExit
+        sites = [self.load_site(d, resume) for d in dicts]
+
+        self._r.status('RUNNING CASES')
+        cases = self.run_sites(sites, cores)
+        self._r.status('DONE running cases')
+
+        for site, site_cases in zip(sites, cases):
+            self._r.status('Ploting hit-rate')
+            self.calcHitRate(site_cases, site.pdf, site.wind_dict)
+
+            # TODO
+            self._r.status('plotting wind rose and histogram at specified location')
+            # TODO
+            site.pdf.close()
+            self._r.status(site.pdf.filename)
+        if self._plots == 'gui':
+            self._r.plot.show()
+        self._r.status('exiting')
+
+    def load_site(self, dict, resume=None):
+        """
+        reads a windPyFoamDict and prepares its cases. template, meshCache,
+        the runs directory, results.pdf and initialWindRose.pdf are taken
+        relative to the windPyFoamDict's directory
         """
         if not os.path.exists(dict):
             self._r.error("missing %s file" % dict)
@@ -561,10 +1052,25 @@ class Solver(object):
             self._r.error("failed to parse windPyFoam parameter file:")
             self._r.error(str(e))
             raise SystemExit
-        wind_dict['runs'] = self.run_directory('runs')
+        directory = os.path.dirname(dict)
+        for key in ['template', 'meshCache']:
+            try:
+                value = read_dict_string(wind_dict, key)
+            except KeyError:
+                continue
+            if value != '' and not os.path.isabs(value):
+                wind_dict[key] = '"%s"' % os.path.join(directory, value)
+        if resume is not None:
+            if not os.path.isdir(resume):
+                self._r.error("missing runs directory %s" % resume)
+                raise SystemExit
+            wind_dict['runs'] = resume
+        else:
+            wind_dict['runs'] = self.run_directory(os.path.join(directory, 'runs'))
+        self.check_procnr(wind_dict)
 
         # starting the pdf file for accumilating graphical results
-        pdf = PdfPages('results.pdf')
+        pdf = Pages(os.path.join(directory, 'results.pdf'), self.plot_workers(wind_dict))
 
         # preparing the grid, bc and ic for all cases
         gen = []
@@ -572,66 +1078,186 @@ class Solver(object):
             gen = self.grid_convergance_params_generator(wind_dict)
         gen = itertools.chain(gen,
                 self.wind_rose_params_generator(wind_dict))
-        cases = []
+        params_list = list(gen)
         names = []
-
-        for params in gen:
-            self._r.debug(params['name'])
-            work = self.create_case(wind_dict, params)
+        for params in params_list:
+            params['phi'] = params['wind_dir'] * pi / 180
             names.append('wind%s' % int(180 / pi * params['phi']))
-            cases.append(work)
 
         # plotting initial wind rose
-        pdf2 = PdfPages('initialWindRose.pdf')
-        self.plot_initial_wind_rose(wind_dict, params)
-        pdf2.savefig()
+        initial = os.path.join(directory, 'initialWindRose.pdf')
+        pdf2 = PdfPages(initial)
+        ax = self.plot_initial_wind_rose(wind_dict, params)
+        pdf2.savefig(ax.figure)
         pdf2.close()
-        os.system('xdg-open initialWindRose.pdf')
+        if self._plots != 'gui':
+            ax.figure.clf()
+        os.system('xdg-open %s' % initial)
 
-        self._r.status('RUNNING CASES')
         runArg = read_dict_string(wind_dict, 'runArg')
         self._r.status(runArg)
         assert(runArg in ['Runner', 'plotRunner', 'sfoam'])
-        runCases(names=names,
-                 n=wind_dict['procnr'], runArg=runArg,
-                 cases=[case.name for case in cases])
-        self._r.status('DONE running cases')
-        # reconstructing case
-        self._r.status('Reconstructing cases')
-        self.reconstructCases([case.name for case in cases])
-
-        self._r.status('Building sample dictionaries')
-        self.sampleDictionaries(cases, work, wind_dict)
-
-        self._r.status('Ploting hit-rate')
-        self.calcHitRate(cases, pdf, wind_dict)
-
-        self._r.status('Ploting contour maps at specified heights')
-        self.plotContourMaps(cases, pdf, wind_dict)
-        # TODO
-        self._r.status('plotting wind rose and histogram at specified location')
-        # TODO
-        pdf.close()
-        self._r.status('results.pdf')
-        if self._plots == 'gui':
-            self._r.plot.show()
-        self._r.status('exiting')
+        return Site(self, wind_dict, params_list, names, pdf, directory=directory,
+                    resume=resume is not None)
+
+class Site(object):
+    """
+    the cases of one windPyFoamDict going through Solver.run_sites and
+    their pipeline state. directory is where the windPyFoamDict is, the
+    contour grids are kept there
+    """
+    def __init__(self, solver, wind_dict, params_list, names, pdf, directory='', resume=False):
+        self.wind_dict = wind_dict
+        self.params_list = params_list
+        self.names = names
+        self.pdf = pdf
+        self.directory = directory
+        self.resume = resume
+        self.contours = ContourMaps(solver, wind_dict, os.path.join(directory, 'contours'))
+        template = read_dict_string(wind_dict, 'template')
+        self.fps = [fingerprints.stage_fingerprints(wind_dict, params, template)
+                    for params in params_list]
+        self.case_dirs = [os.path.realpath(params['case_dir']) for params in params_list]
+        self.records = [fingerprints.CaseRecord(case_dir) for case_dir in self.case_dirs]
+        procnr = wind_dict['procnr']
+        self.stage_procs = {'mesh': wind_dict['procnrSnappy'] if procnr > 1 else 1,
+                            'bc': 1, 'solve': procnr, 'reconstruct': 1, 'sample': 1}
+        self.workers = max(read_dict_default(wind_dict, 'prepareWorkers', 1), 1)
+        # reconstructed cases, for warm starting the ones that follow
+        self.solved = {}
+        self.done = []
+        self.up_to_date = []
+        self.unmeshed = []
 
-def run_windpyfoam(reporter, dict, plots):
+    def add_solved(self, i):
+        params = self.params_list[i]
+        if 'i' in params:
+            us = self.wind_dict['caseTypes']['windRose']['windDir'][params['i']][4]
+            self.solved[i] = (self.case_dirs[i], params['wind_dir'], params['cell_size'], us)
+
+    def stage_args(self, i, stage, gate):
+        wind_dict, params, case_dir = self.wind_dict, self.params_list[i], self.case_dirs[i]
+        if stage == 'mesh':
+            return (wind_dict, params)
+        if stage == 'bc':
+            return (wind_dict, params, case_dir)
+        if stage == 'solve':
+            return (wind_dict, params, self.names[i], case_dir, gate, self.resume, self.solved)
+        return (wind_dict, case_dir)
+
+class ContourMaps(object):
+    """
+    velocity contour maps at the hSample heights, one case at a time, and
+    the wind rose weighted average speed and power density of all the cases
+    plotted so far.
+
+    the grids are also kept in a gridstore in directory, the averages are
+    updated there after every case that goes into them. with averageOnDisk
+    in sampleParams the running averages are memory mapped in directory,
+    with rawCache the sampled raw files are cached as .npy (see rawfile).
+    """
+    def __init__(self, solver, wind_dict, directory='contours'):
+        self._solver = solver
+        self._wind_dict = wind_dict
+        self._grids = gridstore.GridStore(directory)
+        self.xi = contour_grid(wind_dict)
+        self.yi = self.xi
+        self.xmesh, self.ymesh = meshgrid(self.xi, self.yi)
+        # surfaces sharing x, y (heights of one case, cases of one mesh) share a triangulation
+        self._weights = WeightsCache(self.xmesh, self.ymesh)
+        self.hs = wind_dict['sampleParams']['hSample']
+        self._raw_cache = bool(read_dict_default(wind_dict['sampleParams'], 'rawCache', 0))
+        on_disk = read_dict_default(wind_dict['sampleParams'], 'averageOnDisk', 0)
+        self.average = WindRoseAverage(len(self.hs), self.xmesh.shape,
+                                       rho=read_dict_default(wind_dict['sampleParams'], 'rho', 1.225),
+                                       directory=directory if on_disk else None)
+
+    def plot_case(self, case, params, pdf):
+        """
+        params['i'] is the index of the case in windDir, cases without it
+        (grid convergence) are plotted but not averaged
+        """
+        solver, wind_dict = self._solver, self._wind_dict
+        xi, yi = self.xi, self.yi
+        if 'i' in params:
+            weight = wind_dict["caseTypes"]["windRose"]["windDir"][params['i']][0]
+        else:
+            weight = 0
+        # the latest sampled time, PyFoamState.CurrentTime is only there when run by PyFoam
+        lastTime = max(os.listdir(path.join(case.name, 'surfaces')), key=float)
+        for hi, h in enumerate(self.hs):
+            data = rawfile.read_raw(path.join(case.name,'surfaces',lastTime,'U_agl_'+str(h)+'.raw'),
+                                    cache=self._raw_cache)
+            # after a long trial and error - matplotlib griddata is shaky and crashes on some grids. scipy.interpolate works on every grid i tested so far,
+            # the weights cache does the same linear interpolation on the scipy triangulation
+            vi = self._weights.griddata(data[:,:2], (data[:,3]**2+data[:,4]**2)**0.5)
+            self.page(pdf, case.name+'\n at height '+str(h)+' meter agl', vi,
+                      os.path.join(case.name, 'contour_h%s' % h))
+            name = os.path.basename(case.name.rstrip('/'))
+            self._grids.put('%s_h%s' % (name, h), vi, xi, yi,
+                            kind='case', case=name, height=h, weight=weight)
+            if weight != 0:
+                self.average.add(hi, vi, weight)
+        if weight != 0:
+            self.store_average()
+
+    def store_average(self):
+        average = self.average
+        for hi, h in enumerate(self.hs):
+            self._grids.put('average_h%s' % h, average.mean(hi), self.xi, self.yi,
+                            kind='average', height=h)
+            self._grids.put('std_h%s' % h, average.variance(hi) ** 0.5, self.xi, self.yi,
+                            kind='std', height=h)
+            self._grids.put('power_density_h%s' % h, average.power_density(hi), self.xi, self.yi,
+                            kind='power_density', height=h)
+        average.flush()
+
+    def page(self, pdf, title, grid, svg_name):
+        """
+        a contour page of grid. the gui draws it with pyplot here, so it is
+        there for show(), otherwise pdf (a render.Pages) draws it
+        """
+        solver = self._solver
+        if solver._plots == 'gui':
+            plt = solver._r.plot
+            ax = solver.newFigure()
+            plt.title(title)
+            CS = plt.contourf(self.xi, self.yi, grid, 400, cmap=plt.cm.jet, linewidths=0)
+            plt.colorbar(CS)
+            pdf.savefig()
+            return
+        svg = None
+        if solver._plots == 'svg':
+            svg = svg_name + '.svg'
+            solver._r.status('PLOT %s' % svg)
+        pdf.contour(title, self.xi, self.yi, grid, svg)
+
+    def plot_average(self, pdf):
+        solver = self._solver
+        for hi, h in enumerate(self.hs):
+            self.page(pdf, 'average wind velocity at height ' + str(h) + ' meter agl',
+                      self.average.mean(hi), 'average_wind_velocity_h_%s' % str(h))
+            self.page(pdf, 'power density [W/m^2] at height ' + str(h) + ' meter agl',
+                      self.average.power_density(hi), 'power_density_h_%s' % str(h))
+        self.store_average()
+        solver._r.debug('interpolation weights: %d triangulations for %d surfaces' %
+                        (self._weights.misses, self._weights.misses + self._weights.hits))
+
+def run_windpyfoam(reporter, dicts, plots, resume=None, cores=None):
     solver = Solver(reporter, plots=plots)
-    solver.run_windpyfoam(dict)
+    solver.run_windpyfoam(dicts, resume=resume, cores=cores)
 
 ## Tests
 
 def test_plot_initial_wind_rose():
     stdio = __import__('stdio')
     winddict = ParsedParameterFile('windPyFoamDict')
-    solver = Solver(stdio, True)
+    solver = Solver(stdio, plots='gui')
     solver.plot_initial_wind_rose(winddict, {})
     stdio.plot.show()
 
 def test_plot_contour_maps():
-    pdf = PdfPages('test_contour.pdf')
+    pdf = Pages('test_contour.pdf')
     stdio = __import__('stdio')
     wind_dict = ParsedParameterFile('windPyFoamDict')
     solver = Solver(stdio, plots='svg')
@@ -640,7 +1266,46 @@ def test_plot_contour_maps():
             self.name = name
     cases = [FakeCase(name='runs_20121215_122648/test_template_rose_270/')]
     solver.plotContourMaps(cases, pdf, wind_dict)
-    stdio.plot.show()
+    pdf.close()
+
+def test_warm_start_after_mesh_cache_store():
+    top = tempfile.mkdtemp()
+    try:
+        source = path.join(top, 'source')
+        for name in ['system/controlDict', 'constant/polyMesh/points', '0/U', '100/U']:
+            if not path.exists(path.dirname(path.join(source, name))):
+                makedirs(path.dirname(path.join(source, name)))
+            with open(path.join(source, name), 'w') as fd:
+                fd.write('')
+        cache = meshcache.MeshCache(path.join(top, 'cache'))
+        cache.store('key', source)
+        fetched = path.join(top, 'fetched')
+        shutil.copytree(source, fetched, ignore=shutil.ignore_patterns('polyMesh'))
+        assert(cache.fetch('key', fetched))
+        target = path.join(top, 'target')
+        makedirs(path.join(target, 'system'))
+        class Reporter(object):
+            def status(self, msg):
+                pass
+        solver = Solver(Reporter(), plots='svg')
+        ran = []
+        def run_utility(argv, name):
+            if name == 'transformPoints':
+                # writes the points as transformPoints does
+                with open(path.join(argv[argv.index('-case') + 1], 'constant', 'polyMesh', 'points'), 'a') as fd:
+                    fd.write('()')
+            ran.append(name)
+            return True
+        solver.run_utility = run_utility
+        wind_dict = {'SHMParams': {'centerOfDomain': {'x0': 0, 'y0': 0}}}
+        for case_dir in [source, fetched]:
+            del ran[:]
+            assert(solver.warm_start(wind_dict, {'wind_dir': 90, 'cell_size': 1},
+                                     target, (case_dir, 0, 1, 10)))
+            assert(ran == ['transformPoints'] * 3 + ['mapFields'])
+        assert(os.access(path.join(source, 'constant', 'polyMesh', 'points'), os.W_OK))
+    finally:
+        shutil.rmtree(top)
 
 if __name__ == '__main__':
     test_plot_contour_maps()
@@ -1,11 +1,50 @@
+"""
+reporter writing to stdout. when the parent passes a file descriptor in
+WINDPYFOAM_PROGRESS_FD every report is also written to it as one JSON
+object per line, see progress()
+"""
+import os
+import json
+import time
+
+_progress_fd = os.environ.get('WINDPYFOAM_PROGRESS_FD')
+if _progress_fd is not None:
+    _progress_fd = int(_progress_fd)
+
+def _emit(record):
+    if _progress_fd is None:
+        return
+    record.setdefault('time', time.time())
+    record.setdefault('pid', os.getpid())
+    # a single write below PIPE_BUF is atomic, so the worker processes
+    # inheriting the fd don't interleave their lines
+    try:
+        os.write(_progress_fd, json.dumps(record) + '\n')
+    except OSError:
+        pass
+
 def warn(x):
     print "WARNING:", x
+    _emit(dict(kind='warn', text=str(x)))
 
 def debug(x):
     print "DEBUG:", x
 
+def error(x):
+    print "ERROR:", x
+    _emit(dict(kind='error', text=str(x)))
+
 def status(x):
     print "STATUS:", x
+    _emit(dict(kind='status', text=str(x)))
+
+def progress(**record):
+    """
+    machine readable progress: stage, case, percent, iteration, residuals,
+    elapsed (seconds), whichever are known. nothing is printed
+    """
+    record['kind'] = 'progress'
+    _emit(record)
 
 def run(f, kw):
     f(**kw)
@@ -1,16 +1,36 @@
 #!/usr/bin/python
-     
+
 import sys
 import os
-     
+import re
+
+import numpy
+
 """
  facet normal 0.0000 0.0302 -0.0302
  outer loop
  vertex -67.0000 3.8597 1.0000
  vertex -67.1060 3.8940 1.0000
  vertex -67.0000 4.1445 1.0000
+
+ascii or binary stl files are read into an (N, 3, 3) float array, facet,
+vertex, coordinate, transformed as a whole and written back in either
+format. the facet normals are recomputed on writing. the solids (regions)
+of an ascii stl are kept apart by read_solids and write_solids.
 """
-     
+
+BINARY_FACET = numpy.dtype([('normal', '<f4', (3,)),
+                            ('vertices', '<f4', (3, 3)),
+                            ('attribute', '<u2')])
+
+ASCII_FACET = (' facet normal %.10g %.10g %.10g\n'
+               '  outer loop\n'
+               '   vertex %.10g %.10g %.10g\n'
+               '   vertex %.10g %.10g %.10g\n'
+               '   vertex %.10g %.10g %.10g\n'
+               '  endloop\n'
+               ' endfacet\n')
+
 def main():
     try:
         dz = float(sys.argv[-1])
@@ -21,11 +41,135 @@ def main():
         stl_shift_z_filenames(sys.argv[1], sys.argv[2], dz)
     else:
         stl_shift_z_streams(sys.stdin, sys.stdout, dz)
- 
+
 def error(msg):
     sys.stderr.write("Error: %s\n" % msg)
     raise SystemExit
- 
+
+def _binary_count(head, size):
+    """
+    the facet count of a binary stl of size bytes starting with head, None
+    if it is not one. a binary stl is an 80 byte header, a facet count and
+    50 bytes per facet
+    """
+    if size < 84:
+        return None
+    n = numpy.frombuffer(head[80:84], dtype='<u4')[0]
+    if size != 84 + n * BINARY_FACET.itemsize:
+        return None
+    return n
+
+def is_binary(filename):
+    with open(filename, 'rb') as fd:
+        head = fd.read(84)
+    return _binary_count(head, os.path.getsize(filename)) is not None
+
+def _ascii_triangles(text, what):
+    coordinates = ' '.join(re.findall(r'vertex\s+([^\n]+)', text))
+    triangles = numpy.fromstring(coordinates, sep=' ') if coordinates else numpy.zeros(0)
+    if len(triangles) % 9 != 0:
+        raise ValueError('%s: %d vertex coordinates is not whole facets' % (what, len(triangles)))
+    return triangles.reshape(-1, 3, 3)
+
+def parse_solids(data, what='stl'):
+    """
+    [(name, triangles)] of the solids in data, the contents of an stl
+    file. a binary stl is a single solid, the header its name
+    """
+    n = _binary_count(data[:84], len(data))
+    if n is not None:
+        facets = numpy.frombuffer(data, dtype=BINARY_FACET, count=n, offset=84)
+        return [(data[:80].rstrip(' \0'), facets['vertices'].astype(float))]
+    solids = [(m.group(1).strip(), _ascii_triangles(m.group(2), '%s solid %s' % (what, m.group(1).strip())))
+              for m in re.finditer(r'^\s*solid[ \t]*([^\n]*)\n(.*?)^\s*endsolid', data, re.M | re.S)]
+    if len(solids) == 0:
+        # no endsolid, all the facets are one solid
+        m = re.match(r'\s*solid[ \t]*([^\n]*)', data)
+        solids = [(m.group(1).strip() if m else '', _ascii_triangles(data, what))]
+    return solids
+
+def read_solids(filename):
+    """
+    [(name, triangles)], the solids (regions) of filename, each triangles
+    an (N, 3, 3) float array
+    """
+    with open(filename, 'rb') as fd:
+        return parse_solids(fd.read(), filename)
+
+def read_stl(filename):
+    """
+    returns (triangles, name), triangles an (N, 3, 3) float array of all
+    the solids together and name the first one's. see read_solids to keep
+    the solids apart
+    """
+    solids = read_solids(filename)
+    return numpy.concatenate([triangles for name, triangles in solids]), solids[0][0]
+
+def normals(triangles):
+    n = numpy.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    length = numpy.sqrt((n ** 2).sum(axis=1))
+    length[length == 0] = 1
+    return n / length[:, numpy.newaxis]
+
+def dump_solids(fd, solids, binary=True, chunk=100000):
+    """
+    writes the (name, triangles) solids to the open file fd. a binary stl
+    holds a single solid, the solids are written as one named after the
+    first
+    """
+    if binary:
+        triangles = numpy.concatenate([t for name, t in solids])
+        facets = numpy.zeros(len(triangles), dtype=BINARY_FACET)
+        facets['normal'] = normals(triangles)
+        facets['vertices'] = triangles
+        fd.write(solids[0][0][:80].ljust(80, ' '))
+        fd.write(numpy.array([len(triangles)], dtype='<u4').tostring())
+        fd.write(facets.tostring())
+        return
+    for name, triangles in solids:
+        fd.write('solid %s\n' % name)
+        for start in xrange(0, len(triangles), chunk):
+            part = triangles[start:start + chunk]
+            rows = numpy.hstack((normals(part), part.reshape(-1, 9)))
+            fd.write((ASCII_FACET * len(part)) % tuple(rows.ravel()))
+        fd.write('endsolid %s\n' % name)
+
+def write_solids(filename, solids, binary=True, chunk=100000):
+    with open(filename, 'wb' if binary else 'w') as fd:
+        dump_solids(fd, solids, binary, chunk)
+
+def write_stl(filename, triangles, name='', binary=True, chunk=100000):
+    write_solids(filename, [(name, triangles)], binary, chunk)
+
+def transform(triangles, matrix=None, offset=None):
+    """
+    x -> matrix x + offset for every vertex
+    """
+    if matrix is not None:
+        triangles = numpy.dot(triangles, numpy.asarray(matrix, dtype=float).T)
+    if offset is not None:
+        triangles = triangles + numpy.asarray(offset, dtype=float)
+    return triangles
+
+def shift(triangles, dx=0, dy=0, dz=0):
+    return transform(triangles, offset=(dx, dy, dz))
+
+def scale(triangles, factor, center=(0, 0, 0)):
+    center = numpy.asarray(center, dtype=float)
+    return transform(triangles - center, matrix=numpy.eye(3) * factor, offset=center)
+
+def rotate_z(triangles, angle, center=(0, 0, 0)):
+    """
+    rotates by angle radians, counter clockwise seen from above, around
+    the vertical axis through center
+    """
+    c, s = numpy.cos(angle), numpy.sin(angle)
+    center = numpy.asarray(center, dtype=float)
+    return transform(triangles - center, matrix=[[c, -s, 0], [s, c, 0], [0, 0, 1]], offset=center)
+
+def shift_solids(solids, dz):
+    return [(name, shift(triangles, dz=dz)) for name, triangles in solids]
+
 def stl_shift_z_filenames(file_in, file_out, dz):
     if not os.path.exists(file_in):
         # Another option is to return an error code or raise
@@ -33,17 +177,12 @@ def stl_shift_z_filenames(file_in, file_out, dz):
         error("%s does not exists" % file_in)
     if os.path.exists(file_out):
         error("%s exists, not overwriting" % file_out)
-    with open(file_in, 'r') as fd_in:
-        with open(file_out, 'w+') as fd_out:
-            stl_shift_z_streams(fd_in, fd_out, dz)
- 
+    write_solids(file_out, shift_solids(read_solids(file_in), dz), binary=is_binary(file_in))
+
 def stl_shift_z_streams(input_stream, output_stream, dz):
-    for l in input_stream:
-        if 'vertex' in l:
-            parts = l.rsplit(' ', 1)
-            output_stream.write(parts[0] + ' ' + str(float(parts[1]) + dz) + '\n')
-        else:
-            output_stream.write(l)
- 
+    data = input_stream.read()
+    binary = _binary_count(data[:84], len(data)) is not None
+    dump_solids(output_stream, shift_solids(parse_solids(data, 'input'), dz), binary=binary)
+
 if __name__ == '__main__':
     main()
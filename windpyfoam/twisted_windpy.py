@@ -1,117 +1,322 @@
 import sys
 import os
+import json
+import errno
+import signal
+from collections import deque
 
 from twisted.internet import reactor, protocol, task
 
+# the states of a Run. a run is queued until a slot is free, then running,
+# and it ends as done (exit code 0), failed or cancelled
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+WINDPYFOAM = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'windpyfoam.py')
+
+PROGRESS_FD = 3
 
 class WindPyProcessProtocol(protocol.ProcessProtocol):
+    """
+    the child reports on PROGRESS_FD, one JSON object per line. stdout is
+    not parsed, stderr only for tracebacks
+    """
 
     def __init__(self, process_manager, i):
         self._process_manager = process_manager
         self._i = i
+        self._partial = {}
 
     def connectionMade(self):
         print "DEBUG: WindPyProcessProtocol.connectionMade"
         #import pdb; pdb.set_trace()
 
     def childDataReceived(self, fd, data):
-        # TODO structured communication
-        print "DEBUG: %s" % repr(data)
-        self._process_manager.on_data(self._i, fd, data)
+        if fd == 1 and not self._process_manager._verbose:
+            return
+        lines = (self._partial.get(fd, '') + data).split('\n')
+        self._partial[fd] = lines.pop()
+        for line in lines:
+            self._line(fd, line)
+
+    def _line(self, fd, line):
+        if fd == PROGRESS_FD:
+            self._process_manager.on_record(self._i, line)
+        else:
+            self._process_manager.on_data(self._i, fd, line)
 
     def processEnded(self, status):
-        self._process_manager.on_data(self._i, None, "PROCESS ENDED");
+        for fd, line in self._partial.items():
+            if line != '':
+                self._line(fd, line)
+        self._partial = {}
         self._process_manager.on_process_ended(self._i, status)
 
+class StatusLog(object):
+    """
+    ring buffer of the last maxlen status lines of one process. every line
+    gets a sequence number from the manager, shared by all the processes,
+    so a client only has to remember the last one it saw.
+    """
+    def __init__(self, maxlen=1000):
+        self._lines = deque(maxlen=maxlen)
+
+    def append(self, seq, i, kind, text):
+        self._lines.append((seq, i, kind, text))
+
+    def since(self, seq):
+        return [line for line in self._lines if line[0] > seq]
+
+class Run(object):
+    """
+    one windpyfoam.py run of a windPyFoamDict: its state, status log and
+    the traceback it died with, if any. the process runs in the directory
+    of the dict, so results.pdf and the runs directory end up next to it.
+    """
+    def __init__(self, i, dict_filename, log_lines):
+        self.i = i
+        self.dict_filename = os.path.realpath(dict_filename)
+        self.dir = os.path.dirname(self.dict_filename)
+        self.state = QUEUED
+        self.log = StatusLog(log_lines)
+        self.traceback = []
+        self.in_traceback = False
+        # the last progress record of every case, and of the run itself
+        self.progress = {}
+        self.exit_code = None
+        self.process = None
+        self.pid = None
+
+    def info(self, queue_position=None):
+        return dict(id=self.i, dict=self.dict_filename, state=self.state,
+                    pid=self.pid, exit_code=self.exit_code,
+                    queue_position=queue_position,
+                    progress=self.progress.get(None),
+                    cases=dict((case, record) for case, record in self.progress.items()
+                               if case is not None),
+                    traceback='\n'.join(self.traceback))
+
 class ProcessManager(object):
+    """
+    registry of windpyfoam.py runs. any number of dict files can be
+    launched, at most max_running of them run at the same time and the
+    rest wait in launch order.
+    """
 
-    def __init__(self):
-        self._processes = []
+    def __init__(self, log_lines=1000, max_running=1):
+        self._runs = []
+        self._queue = deque()
         self._verbose = False
-        self._pending_status = []
-        self._during_traceback = False
+        self._log_lines = log_lines
+        self._max_running = max_running
+        self._seq = 0
+        self._listeners = []
+
+    def on_data(self, i, fd, line):
+        """
+        a line of stdout (verbose only) or stderr
+        """
+        run = self._runs[i]
+        if self._verbose:
+            sys.stdout.write("proc %d: %s\n" % (run.pid, line))
+        if fd != 2:
+            return
+        if run.in_traceback:
+            run.traceback.append(line)
+            self._push(i, 'error', line)
+            # the frames are indented, the exception line ends the traceback
+            if not line.startswith(' '):
+                run.in_traceback = False
+        elif line.startswith('Traceback'):
+            run.traceback.append(line)
+            run.in_traceback = True
+            self._push(i, 'error', line)
+
+    def on_record(self, i, line):
+        """
+        a JSON line of the progress channel
+        """
+        try:
+            record = json.loads(line)
+        except ValueError:
+            self._push(i, 'error', 'bad progress record %r' % line)
+            return
+        kind = record.pop('kind', 'progress')
+        if kind == 'progress':
+            run = self._runs[i]
+            if 'iteration' in record:
+                # solver iterations of one case
+                run.progress[record.get('case')] = record
+            else:
+                # finished stages, the percent is of the whole run
+                run.progress[None] = record
+            self._push(i, 'progress', json.dumps(record))
+        elif kind in ['status', 'error', 'warn']:
+            if kind == 'status':
+                print "STATUS: (%d) %s" % (self._seq, record['text'])
+            self._push(i, kind, record['text'])
 
-    def on_data(self, i, fd, data):
+    def add_listener(self, f):
         """
-        ignore fd for now
+        f(seq, i, kind, text) is called for every new status line
         """
-        for line in data.split('\n'):
-            self._on_line(i, fd, line)
+        self._listeners.append(f)
+
+    def remove_listener(self, f):
+        if f in self._listeners:
+            self._listeners.remove(f)
 
-    def get_status(self):
-        ret = list(self._pending_status)
-        del self._pending_status[:]
-        #print "DEBUG: %d" % len(ret)
+    def last_seq(self):
+        return self._seq
+
+    def get_status(self, since=0, i=None):
+        """
+        status lines of all runs, or of run i, newer than since, oldest
+        first. lines that fell out of the ring buffers are gone
+        """
+        runs = self._runs if i is None else [self._runs[i]]
+        ret = []
+        for run in runs:
+            ret.extend(run.log.since(since))
+        ret.sort()
         return ret
 
-    def _on_line(self, i, fd, line):
-        if self._verbose:
-            sys.stdout.write("proc %d: %s\n" % (self._processes[i].pid, line))
-        # TODO: send to web client not via polling
-        # TODO: race here, if process disappears before status is read, i will
-        # be invalidated, or worse point to the wrong process.
-        if self._during_traceback:
-            self._pending_status.append((i, 'error', line))
-        elif line.startswith('STATUS: '):
-            status = line[len('STATUS: '):]
-            print "STATUS: (%d) %s" % (len(self._pending_status), status)
-            self._pending_status.append((i, 'status', status))
-        elif line.startswith('Traceback'):
-            self._pending_status.append((i, 'error', line))
-            self._during_traceback = True
+    def _push(self, i, kind, text):
+        self._seq += 1
+        self._runs[i].log.append(self._seq, i, kind, text)
+        for f in list(self._listeners):
+            f(self._seq, i, kind, text)
 
     def process_count(self):
-        return len(self._processes)
+        return len(self._runs)
+
+    def running_count(self):
+        return len([run for run in self._runs if run.state == RUNNING])
+
+    def set_max_running(self, max_running):
+        self._max_running = max_running
+        self._start_queued()
+
+    def runs(self):
+        """
+        info dicts of all the runs, in launch order
+        """
+        queue = list(self._queue)
+        return [run.info(queue.index(run.i) if run.i in queue else None)
+                for run in self._runs]
+
+    def run_info(self, i):
+        if i < 0 or i >= len(self._runs):
+            return None
+        queue = list(self._queue)
+        return self._runs[i].info(queue.index(i) if i in queue else None)
 
     def start_process(self, dict_filename):
         """
+        queue a run of dict_filename, returns its id, or None if the file
+        can't be read. it starts right away if a slot is free
         TODO - give it an stl name
         """
         if not os.path.isfile(dict_filename):
-            return False
+            return None
         try:
             with open(dict_filename) as fd:
                 pass
         except:
-            return False
-        i = len(self._processes)
-        self._processes.append(None)
-        process_protocol = WindPyProcessProtocol(self, i)
+            return None
+        i = len(self._runs)
+        self._runs.append(Run(i, dict_filename, self._log_lines))
+        self._queue.append(i)
+        self._push(i, 'state', QUEUED)
+        self._start_queued()
+        return i
+
+    def cancel(self, i):
+        """
+        drop a queued run or kill a running one. False if it already ended
+        """
+        run = self._runs[i]
+        if run.state == QUEUED:
+            self._queue.remove(i)
+            self._set_state(run, CANCELLED)
+            return True
+        if run.state == RUNNING:
+            run.state = CANCELLED
+            self._terminate(run)
+            return True
+        return False
+
+    def _terminate(self, run):
+        """
+        the run leads its own process group (--process-group), signalling
+        the group also stops its scheduler's children, mpirun and the
+        solvers
+        """
+        try:
+            os.killpg(run.pid, signal.SIGTERM)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+            # not its own group leader yet
+            run.process.signalProcess('TERM')
+
+    def _set_state(self, run, state):
+        run.state = state
+        self._push(run.i, 'state', state)
+
+    def _start_queued(self):
+        while len(self._queue) > 0 and self.running_count() < self._max_running:
+            self._spawn(self._runs[self._queue.popleft()])
+
+    def _spawn(self, run):
+        process_protocol = WindPyProcessProtocol(self, run.i)
         env = dict(os.environ)
+        env['WINDPYFOAM_PROGRESS_FD'] = str(PROGRESS_FD)
         if 'DISPLAY' not in env:
             print "DEBUG: adding DISPLAY"
             env['DISPLAY'] = ':0.0'
-        self._processes[i] = reactor.spawnProcess(process_protocol, '/usr/bin/python',
-                ['/usr/bin/python', 'windpyfoam.py', '--dict', dict_filename,
-                 '--plots=svg'],
-                env=env)
-        self._processes[i].start_pid = self._processes[i].pid
-        return True
+        run.process = reactor.spawnProcess(process_protocol, '/usr/bin/python',
+                ['/usr/bin/python', WINDPYFOAM,
+                 '--dict', os.path.basename(run.dict_filename), '--plots=svg',
+                 '--process-group'],
+                env=env, path=run.dir,
+                childFDs={0: 'w', 1: 'r', 2: 'r', PROGRESS_FD: 'r'})
+        run.pid = run.process.pid
+        self._set_state(run, RUNNING)
 
     def on_process_ended(self, i, status):
-        print self._processes[i].start_pid, "exited"
+        run = self._runs[i]
+        print run.pid, "exited"
+        run.exit_code = status.value.exitCode
+        self._push(i, 'ended', str(run.exit_code))
+        if run.state != CANCELLED:
+            self._set_state(run, DONE if run.exit_code == 0 else FAILED)
+        else:
+            self._push(i, 'state', CANCELLED)
+        self._start_queued()
 
 class TestProcessManager(ProcessManager):
     def on_process_ended(self, i, status):
         super(TestProcessManager, self).on_process_ended(i, status)
-        reactor.stop()
+        if all(run['state'] in FINISHED for run in self.runs()):
+            reactor.stop()
 
 class Tester(object):
-    def __init__(self):
-        self.i = 0
+    def __init__(self, dicts):
+        self.seq = 0
         process_manager = TestProcessManager()
         self.process_manager = process_manager
-        process_manager.start_process('windPyFoamDict')
+        for d in dicts:
+            process_manager.start_process(d)
         print process_manager.process_count()
         t = task.LoopingCall(self.cb)
         t.start(1)
 
     def cb(self):
-        status = self.process_manager.get_status()
-        if len(status) > 0:
-            for i, l in status:
-                print i, l
+        for seq, i, kind, text in self.process_manager.get_status(self.seq):
+            print i, kind, text
+            self.seq = seq
 
 if __name__ == '__main__':
-    tester = Tester()
+    tester = Tester(sys.argv[1:] or ['windPyFoamDict'])
     reactor.run()
@@ -3,18 +3,22 @@
 __version__ = '0.0.1'
 
 import os
+import json
+from argparse import ArgumentParser
 
-from twisted.internet import reactor
-from twisted.web.server import Site
+from twisted.internet import reactor, task, threads
+from twisted.web.server import Site, NOT_DONE_YET
+from twisted.web.resource import Resource
 from twisted.web.wsgi import WSGIResource
 
-from flask import Flask, jsonify, send_file, render_template
+from flask import Flask, Response, jsonify, send_file, render_template, request
 
 # configure matplotlib, our plotting backend, to use Agg
 import matplotlib
 matplotlib.use('Agg')
 
 from twisted_windpy import ProcessManager
+import gridstore
 
 class Web(object):
     """ not used """
@@ -33,26 +37,42 @@ class Web(object):
         self._status.append(x)
 
 class WindPyFoamApp(Flask):
-    def __init__(self):
+    def __init__(self, max_running=1):
         Flask.__init__(self, 'windpyfoam')
-        self.process_manager = ProcessManager()
+        self.process_manager = ProcessManager(max_running=max_running)
 
 app = WindPyFoamApp()
 app.debug = True
 
+def on_reactor(f, *args):
+    """
+    the flask views run in the WSGI thread pool, the process manager
+    belongs to the reactor thread. returns f(*args) called there
+    """
+    return threads.blockingCallFromThread(reactor, f, *args)
+
 @app.route('/')
 def hello():
     return render_template('index.html')
 
 @app.route('/status')
 def status():
-    """ return json """
-    status = app.process_manager.get_status()
-    # NOTE: without enumerate json will clobber.
-    return jsonify(enumerate(status))
-
-# TODO: replace pdf usage with plot viewer, using the actual
-# data instead of rendering on the server.
+    """
+    return json, the status lines after ?since=seq, of all runs or of
+    ?run=id. /events pushes the same lines without polling
+    """
+    since = request.args.get('since', 0, type=int)
+    run = request.args.get('run', None, type=int)
+    if run is not None and on_reactor(app.process_manager.run_info, run) is None:
+        return jsonify(error='no run %d' % run), 404
+    # a snapshot, the reactor appends to the ring buffers
+    last, status_lines = on_reactor(lambda: (app.process_manager.last_seq(),
+                                             app.process_manager.get_status(since, run)))
+    lines = [dict(seq=seq, process=i, kind=kind, text=text)
+             for seq, i, kind, text in status_lines]
+    return jsonify(last=last, lines=lines)
+
+# the results tab draws the grids of /runs/<id>/grids instead
 @app.route('/results.pdf')
 def results():
     if os.path.isfile('results.pdf'):
@@ -63,23 +83,169 @@ def results():
 
 @app.route('/launch')
 def launch():
-    if app.process_manager.process_count() > 0:
-        return 'process running'
-    else:
-        if not app.process_manager.start_process('windPyFoamDict'):
-            return 'Failed to start process'
+    """
+    queue a run for every ?dict=file, windPyFoamDict if none is given.
+    returns json with the ids of the queued runs and the files that could
+    not be read
+    """
+    dicts = request.args.getlist('dict') or ['windPyFoamDict']
+    launched, failed = [], []
+    for d in dicts:
+        i = on_reactor(app.process_manager.start_process, d)
+        if i is None:
+            failed.append(d)
         else:
-            # TODO - for specific process
-            # TODO - use template
-            return 'success'
+            launched.append(i)
+    return jsonify(launched=launched, failed=failed)
+
+@app.route('/runs')
+def runs():
+    return jsonify(runs=on_reactor(app.process_manager.runs))
+
+@app.route('/runs/<int:i>')
+def run_info(i):
+    info = on_reactor(app.process_manager.run_info, i)
+    if info is None:
+        return jsonify(error='no run %d' % i), 404
+    return jsonify(info)
+
+@app.route('/runs/<int:i>/cancel')
+def cancel(i):
+    if on_reactor(app.process_manager.run_info, i) is None:
+        return jsonify(error='no run %d' % i), 404
+    return jsonify(cancelled=on_reactor(app.process_manager.cancel, i))
+
+@app.route('/runs/<int:i>/results.pdf')
+def run_results(i):
+    info = on_reactor(app.process_manager.run_info, i)
+    if info is None:
+        return 'no run %d' % i, 404
+    filename = os.path.join(os.path.dirname(info['dict']), 'results.pdf')
+    if os.path.isfile(filename):
+        return send_file(filename)
+    return 'missing results.pdf'
 
-def run(port=8880):
+def run_grids(i):
+    info = on_reactor(app.process_manager.run_info, i)
+    if info is None:
+        return None
+    return os.path.join(os.path.dirname(info['dict']), 'contours')
+
+@app.route('/runs/<int:i>/grids')
+def grids(i):
+    """
+    json index of the contour grids of a run: name -> kind (case,
+    average, std or power_density), case, height, weight, shape and x/y
+    extent
+    """
+    directory = run_grids(i)
+    if directory is None:
+        return jsonify(error='no run %d' % i), 404
+    response = jsonify(grids=gridstore.read_index(directory))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/runs/<int:i>/grids/<name>.npy')
+def grid(i, name):
+    """
+    a float32 .npy grid, ?level=k takes every 2**k-th point. grids change
+    while the run goes on, clients revalidate with the ETag
+    """
+    directory = run_grids(i)
+    filename = directory and gridstore.grid_filename(directory, name)
+    if filename is None or not os.path.isfile(filename):
+        return 'no grid %s' % name, 404
+    level = min(max(request.args.get('level', 0, type=int), 0), 8)
+    st = os.stat(filename)
+    etag = '%s-%.6f-%d' % (name, st.st_mtime, level)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(gridstore.grid_bytes(filename, level),
+                            mimetype='application/octet-stream')
+    response.set_etag(etag)
+    response.last_modified = int(st.st_mtime)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+class EventStream(Resource):
+    """
+    Server-Sent Events stream of the status lines of all processes.
+
+    a reconnecting browser sends Last-Event-ID and gets what it missed from
+    the ring buffers before the live lines.
+    """
+    isLeaf = True
+    heartbeat = 15.0
+
+    def __init__(self, process_manager):
+        Resource.__init__(self)
+        self._process_manager = process_manager
+        self._requests = []
+        self._heartbeat = task.LoopingCall(self._ping)
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/event-stream')
+        request.setHeader('Cache-Control', 'no-cache')
+        since = request.getHeader('Last-Event-ID') or request.args.get('since', ['0'])[0]
+        try:
+            since = int(since)
+        except ValueError:
+            since = 0
+        for line in self._process_manager.get_status(since):
+            self._send(request, *line)
+        listener = lambda *line: self._send(request, *line)
+        self._process_manager.add_listener(listener)
+        self._requests.append(request)
+        if not self._heartbeat.running:
+            self._heartbeat.start(self.heartbeat, now=False)
+        request.notifyFinish().addBoth(self._finished, request, listener)
+        return NOT_DONE_YET
+
+    def _send(self, request, seq, i, kind, text):
+        request.write('id: %d\nevent: %s\ndata: %s\n\n' %
+                      (seq, kind, json.dumps(dict(process=i, text=text))))
+
+    def _ping(self):
+        for request in self._requests:
+            request.write(':\n\n')
+
+    def _finished(self, _, request, listener):
+        self._process_manager.remove_listener(listener)
+        self._requests.remove(request)
+        if len(self._requests) == 0 and self._heartbeat.running:
+            self._heartbeat.stop()
+
+class Root(Resource):
+    """
+    /events is served by twisted directly, everything else by flask
+    """
+    def __init__(self, wsgi):
+        Resource.__init__(self)
+        self._wsgi = wsgi
+
+    def getChild(self, child, request):
+        request.prepath.pop()
+        request.postpath.insert(0, child)
+        return self._wsgi
+
+    def render(self, request):
+        return self._wsgi.render(request)
+
+def run(port=8880, max_running=1):
     print "running windpyfoam web server %s" % __version__
-    print "listening on port %s" % port
-    root = WSGIResource(reactor, reactor.getThreadPool(), app)
+    print "listening on port %s, at most %d runs at a time" % (port, max_running)
+    app.process_manager.set_max_running(max_running)
+    root = Root(WSGIResource(reactor, reactor.getThreadPool(), app))
+    root.putChild('events', EventStream(app.process_manager))
     factory = Site(root)
     reactor.listenTCP(port, factory)
     reactor.run()
 
 if __name__ == '__main__':
-    run()
+    parser = ArgumentParser()
+    parser.add_argument('--port', type=int, default=8880)
+    parser.add_argument('--max-running', type=int, default=1,
+                        help='runs executing at the same time, the rest are queued')
+    args = parser.parse_args()
+    run(port=args.port, max_running=args.max_running)
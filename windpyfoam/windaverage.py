@@ -0,0 +1,76 @@
+"""
+running wind rose statistics of the contour grids, one case grid at a time.
+
+for every height and grid point it keeps the sum of the weights, the
+weighted mean speed, the weighted sum of squared deviations (West's
+incremental algorithm, for the variance) and the weighted mean of U**3 (for
+the power density rho <U**3> / 2). a grid point a case has no value for
+(nan, outside the sampled surface) is left out of that case's update
+instead of turning the average into nan.
+
+the accumulators are updated chunk_rows rows at a time, so the temporaries
+stay small. with a directory they live in a memory mapped .npy file there
+instead of in memory.
+"""
+
+import os
+
+import numpy
+from numpy.lib.format import open_memmap
+
+WEIGHT, MEAN, M2, CUBE = range(4)
+
+class WindRoseAverage(object):
+
+    def __init__(self, heights, shape, rho=1.225, directory=None, chunk_rows=256):
+        self.rho = rho
+        self.chunk_rows = chunk_rows
+        size = (heights, 4) + tuple(shape)
+        if directory is None:
+            self._acc = numpy.zeros(size)
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._acc = open_memmap(os.path.join(directory, 'wind_rose_accumulators.npy'),
+                                    mode='w+', dtype=numpy.float64, shape=size)
+            self._acc[:] = 0
+
+    def add(self, hi, grid, weight):
+        acc = self._acc[hi]
+        for r0 in xrange(0, grid.shape[0], self.chunk_rows):
+            r1 = r0 + self.chunk_rows
+            x = numpy.asarray(grid[r0:r1], dtype=numpy.float64)
+            valid = ~numpy.isnan(x)
+            x = numpy.where(valid, x, 0)
+            w = numpy.where(valid, weight, 0)
+            total = acc[WEIGHT, r0:r1] + w
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                frac = numpy.where(total > 0, w / total, 0)
+            delta = x - acc[MEAN, r0:r1]
+            acc[MEAN, r0:r1] += frac * delta
+            acc[M2, r0:r1] += w * delta * (x - acc[MEAN, r0:r1])
+            acc[CUBE, r0:r1] += frac * (x ** 3 - acc[CUBE, r0:r1])
+            acc[WEIGHT, r0:r1] = total
+
+    def _where_weighted(self, hi, values):
+        return numpy.where(self._acc[hi, WEIGHT] > 0, values, numpy.nan)
+
+    def mean(self, hi):
+        """
+        weighted mean speed [m/s]
+        """
+        return self._where_weighted(hi, self._acc[hi, MEAN])
+
+    def variance(self, hi):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return self._where_weighted(hi, self._acc[hi, M2] / self._acc[hi, WEIGHT])
+
+    def power_density(self, hi):
+        """
+        rho <U**3> / 2 [W/m^2]
+        """
+        return self._where_weighted(hi, 0.5 * self.rho * self._acc[hi, CUBE])
+
+    def flush(self):
+        if isinstance(self._acc, numpy.memmap):
+            self._acc.flush()
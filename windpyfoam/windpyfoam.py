@@ -56,6 +56,8 @@ run3dHillBase contains the BC (Boundary Condition) code (run3dHillBase.py:run3dH
 """
 
 import atexit
+import os
+import signal
 import sys
 
 import stdio
@@ -71,7 +73,20 @@ from solvers import run_windpyfoam
 
 if __name__ == '__main__':
     parser = ArgumentParser()
-    parser.add_argument('--dict', required=True)
+    parser.add_argument('--dict', required=True, action='append',
+                        help='a windPyFoamDict, repeat to run several sites on one core budget')
     parser.add_argument('--plots', default='gui', choices=['gui', 'svg'])
+    parser.add_argument('--resume', default=None, metavar='RUNS_DIR',
+                        help='redo only the stages whose inputs changed in an earlier runs directory')
+    parser.add_argument('--cores', type=int, default=None,
+                        help='processors shared by all the sites, default is cores of the first windPyFoamDict')
+    parser.add_argument('--process-group', action='store_true',
+                        help='lead a process group of its own, the web server cancels a run by signalling it')
     args = parser.parse_args(sys.argv[1:])
-    run_windpyfoam(stdio, args.dict, args.plots)
+    if args.process_group:
+        os.setpgrp()
+    def terminated(signum, frame):
+        # the scheduler kills its jobs on the way out
+        raise SystemExit('terminated')
+    signal.signal(signal.SIGTERM, terminated)
+    run_windpyfoam(stdio, args.dict, args.plots, resume=args.resume, cores=args.cores)